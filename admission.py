@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import deque
+
+# Ограничение числа одновременных генераций документов в процессе.
+# Генерация КП требует много памяти, поэтому одновременно выполняется не
+# больше limit запросов; следующие ждут свободного места в ограниченной
+# очереди, а при заполненной очереди или долгом ожидании сразу получают отказ.
+
+
+class OverloadedError(RuntimeError):
+    """Запрос не допущен: все места заняты, а очередь ожидания заполнена или ожидание истекло"""
+
+
+class AdmissionControl:
+    """Не больше limit одновременных запросов и очередь ожидания на max_waiting мест.
+
+    Если места нет, а в очереди уже max_waiting запросов, acquire() сразу
+    возбуждает OverloadedError; из очереди запрос выходит с отказом через
+    timeout секунд. Функцию освобождения можно вызвать несколько раз,
+    место освобождается один раз.
+    """
+
+    def __init__(self, limit=2, max_waiting=4, timeout=10):
+        if limit < 1:
+            raise ValueError('Admission limit must be positive')
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._changed = threading.Condition()
+        # Ожидающие запросы допускаются по порядку прихода: освободившееся место
+        # не может занять новый запрос в обход очереди
+        self._waiting = deque()
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._max_wait = 0.0
+
+    def acquire(self):
+        """Занимает место, при необходимости ожидая до timeout секунд; возвращает функцию освобождения"""
+        started = time.perf_counter()
+        with self._changed:
+            if self.active >= self.limit or self._waiting:
+                self._wait_turn(started)
+            self.active += 1
+            self.admitted += 1
+            self._max_wait = max(self._max_wait, time.perf_counter() - started)
+
+        released = []
+        def release():
+            with self._changed:
+                if released:
+                    return
+                released.append(True)
+                self.active -= 1
+                self._changed.notify_all()
+        return release
+
+    def _wait_turn(self, started):
+        # Вызывается под self._changed
+        if len(self._waiting) >= self.max_waiting:
+            self.rejected += 1
+            raise OverloadedError('Сервер перегружен, повторите запрос позже.')
+        turn = object()
+        self._waiting.append(turn)
+        try:
+            while self._waiting[0] is not turn or self.active >= self.limit:
+                remaining = started + self.timeout - time.perf_counter()
+                if remaining <= 0:
+                    self.timed_out += 1
+                    raise OverloadedError('Сервер перегружен, повторите запрос позже.')
+                self._changed.wait(remaining)
+        finally:
+            self._waiting.remove(turn)
+            # Следующий в очереди проверяет, не его ли теперь очередь
+            self._changed.notify_all()
+
+    def stats(self):
+        with self._changed:
+            return {
+                'limit': self.limit,
+                'queue_limit': self.max_waiting,
+                'active': self.active,
+                'waiting': len(self._waiting),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'max_wait_seconds': round(self._max_wait, 4),
+            }
@@ -1,108 +1,184 @@
-from flask import Flask, render_template, request, send_file, flash, send_from_directory, jsonify
-from openpyxl import load_workbook
-from docx import Document
+from flask import Flask, Response, render_template, request, send_file, flash, send_from_directory, jsonify, url_for, g
 import os
+import time
+import atexit
+import queue
 from io import BytesIO
 import logging
-from logging.handlers import RotatingFileHandler
-import zipfile
-import re
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from datetime import datetime
+from urllib.parse import quote as url_quote
 import json
+from batch import BATCH_MAX_ROWS, BatchReport, read_rows, validate_rows, iter_batch_zip
+from scenarios import ScenarioError, build_grid, scenario_filename
+from admission import AdmissionControl, OverloadedError
+from jobs import DONE, JobQueue, QueueFullError
+from history import QuoteHistory, quote_key
+from settings import load_settings
+from zipstream import ZipMember, iter_zip, zip_size
+from metrics import IN_FLIGHT, REQUESTS, REQUEST_SECONDS, RESPONSE_BYTES, registry, timed
+from quotes import (EXCEL_TEMPLATE_PATH, WORD_TEMPLATE_PATH, MIMETYPES, QuoteDataError, templates,
+                    warm_templates, validate_form_data, validate_items, items_from_form,
+                    parse_formats, build_quote, price_quote, render_excel, render_word)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 
 # Настройка логирования
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-file_handler = RotatingFileHandler('logs/kp_generator.log', maxBytes=10240, backupCount=10)
+LOG_FILE = os.environ.get('KP_LOG_FILE', os.path.join('logs', 'kp_generator.log'))
+if not os.path.exists(os.path.dirname(LOG_FILE) or '.'):
+    os.makedirs(os.path.dirname(LOG_FILE))
+file_handler = RotatingFileHandler(
+    LOG_FILE,
+    maxBytes=int(os.environ.get('KP_LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    backupCount=int(os.environ.get('KP_LOG_BACKUPS', 5)),
+    encoding='utf-8',
+)
 file_handler.setFormatter(logging.Formatter(
     '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
 file_handler.setLevel(logging.INFO)
-app.logger.addHandler(file_handler)
+
+def start_log_writer(records):
+    """Запускает поток, который пишет записи из очереди records в файл лога"""
+    listener = QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    owner = os.getpid()
+    def stop():
+        # Процессы, созданные fork (рабочие процессы gunicorn), наследуют atexit;
+        # их stop() положил бы в общую очередь метку остановки чужого потока записи
+        if os.getpid() == owner:
+            listener.stop()
+    atexit.register(stop)
+    return listener
+
+def use_log_queue(records):
+    """Направляет записи app.logger в очередь records вместо прежней.
+    
+    Рабочие процессы server.py получают очередь multiprocessing от главного
+    процесса: файл лога пишет и ротирует только он.
+    """
+    for handler in [handler for handler in app.logger.handlers if isinstance(handler, QueueHandler)]:
+        app.logger.removeHandler(handler)
+    app.logger.addHandler(QueueHandler(records))
+
+# Запись в файл идет в отдельном потоке: обработчики запросов только кладут запись в очередь
+log_queue = queue.SimpleQueue()
+log_listener = start_log_writer(log_queue)
+use_log_queue(log_queue)
 app.logger.setLevel(logging.INFO)
 app.logger.info('KP Generator startup')
 
-def validate_form_data(form_data):
-    """Проверяет корректность данных формы"""
-    errors = []
-    
-    # Проверка обязательных полей
-    required_fields = ['company', 'product', 'quantity', 'cost_price', 'weight', 'logistics']
-    for field in required_fields:
-        if not form_data.get(field) or not form_data[field].strip():
-            errors.append(f'Поле "{field}" является обязательным.')
-    
-    # Проверка числовых значений
-    numeric_fields = ['quantity', 'cost_price', 'weight', 'logistics', 'duty_percent', 'deal_length_days']
-    for field in numeric_fields:
-        if form_data.get(field) and form_data[field].strip():
-            try:
-                value = float(form_data[field])
-                if value < 0:
-                    errors.append(f'Поле "{field}" должно быть неотрицательным числом.')
-                if field == 'duty_percent' and value > 100:
-                    errors.append(f'Поле "{field}" не может превышать 100%.')
-                if field == 'quantity' and value == 0:
-                    errors.append(f'Поле "{field}" не может быть нулевым.')
-                if field == 'deal_length_days' and value < 30:
-                    errors.append(f'Поле "{field}" не может быть меньше 30 дней.')
-            except ValueError:
-                errors.append(f'Поле "{field}" должно быть числом.')
-    
-    return errors
-
-def get_safe_filename(company_name):
-    """Создает безопасное имя файла из названия компании"""
-    safe_name = re.sub(r'[^\w\s-]', '', company_name).strip()
-    safe_name = re.sub(r'[-\s]+', '_', safe_name)
-    return safe_name[:50]
-
-def calculate_selling_price(quantity, purchase_cost, logistics_rub, duty_percent, weight, deal_length_days=170, margin_percent=30):
-    """Выполняет расчет продажной цены с учетом всех параметров бюджета"""
-    # Константы из бюджета
-    CONVERSION_RATE = 12  # Курс юаня к рублю
-    LOGISTICS_CNR_RATIO = 0.3  # Доля логистики КНР
-    LOGISTICS_RF_RATIO = 0.7  # Доля логистики РФ
-    CONVERSION_FEE_RATE = 0.032  # Комиссия за конвертацию 3.2%
-    CREDIT_RATE = 0.16  # Ставка кредита 16%
-    
-    # Расчет общего веса
-    total_weight = weight * quantity
-    
-    # Перевод логистики в юани и распределение по весу
-    logistics_total_yuan = logistics_rub / CONVERSION_RATE
-    
-    # Расчет логистики на единицу товара (пропорционально весу)
-    logistics_cnr_per_unit = (logistics_total_yuan * LOGISTICS_CNR_RATIO * weight) / total_weight
-    logistics_rf_per_unit = (logistics_total_yuan * LOGISTICS_RF_RATIO * weight) / total_weight
-    
-    # Расчет пошлины на единицу товара
-    duty_per_unit = (purchase_cost + logistics_cnr_per_unit) * (duty_percent / 100)
-    
-    # Расчет стоимости конвертации
-    conversion_fee = purchase_cost * quantity * CONVERSION_FEE_RATE
-    conversion_fee_per_unit = conversion_fee / quantity
-    
-    # Расчет кредитных затрат
-    credit_cost = purchase_cost * quantity * CREDIT_RATE / 365 * deal_length_days
-    credit_cost_per_unit = credit_cost / quantity
-    
-    # Общие затраты на единицу товара
-    total_cost_per_unit = (
-        purchase_cost +
-        logistics_cnr_per_unit +
-        logistics_rf_per_unit +
-        duty_per_unit +
-        conversion_fee_per_unit +
-        credit_cost_per_unit
-    )
-    
-    # Расчет цены для маржи margin_percent%
-    selling_price_per_unit = total_cost_per_unit / (1 - margin_percent / 100)
+# История КП и кэш готовых архивов; лимиты из config/settings.json
+settings = load_settings()
+quote_history = QuoteHistory(
+    os.environ.get('KP_DATA_DIR', 'data'),
+    max_items=settings['max_history_items'],
+    max_bytes=settings['max_history_bytes'],
+)
+
+# Фоновая генерация: размер пула и тип исполнителей задаются переменными окружения.
+# Задания хранятся в памяти процесса, поэтому с несколькими рабочими процессами
+# server.py их нужно выключить: KP_JOBS=0
+JOBS_ENABLED = os.environ.get('KP_JOBS', '1') != '0'
+JOB_ENDPOINTS = {'submit_job', 'job_status', 'job_result', 'jobs_stats'}
+job_queue = None if not JOBS_ENABLED else JobQueue(
+    workers=int(os.environ.get('KP_JOB_WORKERS', 0)) or None,
+    executor=os.environ.get('KP_JOB_EXECUTOR', 'thread'),
+    max_queued=int(os.environ.get('KP_JOB_QUEUE_SIZE', 100)),
+    result_ttl=int(os.environ.get('KP_JOB_RESULT_TTL', 3600)),
+    history=quote_history,
+    logger=app.logger,
+)
+
+# Одновременных генераций в процессе не больше KP_MAX_RENDERS, еще KP_RENDER_QUEUE
+# запросов ждут места до KP_RENDER_WAIT секунд; остальные сразу получают 503
+admission = AdmissionControl(
+    limit=int(os.environ.get('KP_MAX_RENDERS', 2)),
+    max_waiting=int(os.environ.get('KP_RENDER_QUEUE', 4)),
+    timeout=float(os.environ.get('KP_RENDER_WAIT', 10)),
+)
+RETRY_AFTER = os.environ.get('KP_RETRY_AFTER', '5')
+ADMISSION_ENDPOINTS = {'generate', 'generate_batch', 'scenarios'}
+
+for path, error in warm_templates():
+    if isinstance(error, FileNotFoundError):
+        app.logger.warning(f'Template not found at startup: {path}')
+    else:
+        app.logger.error(f'Template preload error for {path}: {str(error)}')
+
+@app.before_request
+def start_request_metrics():
+    g.started = time.perf_counter()
+    g.endpoint = request.endpoint or 'unknown'
+    IN_FLIGHT.inc(endpoint=g.endpoint)
+
+@app.before_request
+def admit_render():
+    """Генерация документов допускается только при свободном месте, иначе быстрый 503"""
+    if g.endpoint not in ADMISSION_ENDPOINTS:
+        return None
+    try:
+        g.release_admission = admission.acquire()
+    except OverloadedError as e:
+        g.outcome = 'overloaded'
+        return jsonify({'errors': [str(e)]}), 503, {'Retry-After': RETRY_AFTER}
+    return None
+
+@app.before_request
+def check_jobs_enabled():
+    if job_queue is None and g.endpoint in JOB_ENDPOINTS:
+        return jsonify({'errors': ['Фоновая генерация выключена (KP_JOBS=0).']}), 404
+    return None
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = g.get('endpoint')
+    if endpoint is None:
+        return response
+    outcome = g.get('outcome') or ('ok' if response.status_code < 400
+                                   else 'invalid' if response.status_code < 500 else 'error')
+    REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+    if response.content_length is not None:
+        RESPONSE_BYTES.inc(response.content_length, endpoint=endpoint)
+    elif response.is_streamed:
+        response.response = _count_bytes(response.response, endpoint)
     
-    return selling_price_per_unit
+    started = g.started
+    release_admission = g.pop('release_admission', None)
+    finished = []
+    def finish():
+        # Для потоковых ответов запрос завершается, когда отдана последняя часть;
+        # close() может прийти и от сервера, и от обертки ответа, считаем один раз
+        if finished:
+            return
+        finished.append(True)
+        IN_FLIGHT.dec(endpoint=endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        if release_admission is not None:
+            release_admission()
+    if response.direct_passthrough:
+        # Файлы с диска (send_file) werkzeug отдает мимо close-обработчиков ответа
+        finish()
+    else:
+        response.call_on_close(finish)
+    return response
+
+@app.teardown_request
+def release_render_slot(error=None):
+    # Место освобождает after_request; здесь — если до него дело не дошло
+    release = g.pop('release_admission', None)
+    if release is not None:
+        release()
+
+def _count_bytes(chunks, endpoint):
+    for chunk in chunks:
+        RESPONSE_BYTES.inc(len(chunk), endpoint=endpoint)
+        yield chunk
+
+@app.route('/metrics')
+def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -116,176 +192,317 @@ def favicon():
 @app.route('/generate', methods=['POST'])
 def generate():
     form_data = request.form.to_dict()
-    errors = validate_form_data(form_data)
+    items = items_from_form(request.form)
+    extra_items = items[1:]
+    with timed('validation'):
+        errors = validate_form_data(form_data) + validate_items(items)
+        try:
+            formats = parse_formats(request.form.getlist('formats'))
+        except QuoteDataError as e:
+            errors.append(str(e))
     
     if errors:
+        g.outcome = 'invalid'
         for error in errors:
             flash(error, 'danger')
-        return render_template('index.html', form_data=form_data)
+        return render_template('index.html', form_data=form_data, extra_items=extra_items)
     
+    # Пока обработчик не дошел до ответа, любой выход считается ошибкой
+    g.outcome = 'error'
     try:
-        # Извлечение и преобразование данных
-        company = form_data['company'].strip()
-        product = form_data['product'].strip()
-        quantity = int(form_data['quantity'])
-        cost_price = float(form_data['cost_price'])
-        weight = float(form_data['weight'])
-        logistics = float(form_data['logistics'])
-        
-        # Новые поля
-        tender_number = form_data.get('tender_number', '').strip()
-        drawing_number = form_data.get('drawing_number', '').strip()
-        material = form_data.get('material', '').strip()
-        delivery_address = form_data.get('delivery_address', '').strip()
-        duty_percent = float(form_data.get('duty_percent', 0))
-        deal_length_days = float(form_data.get('deal_length_days', 170))
-        
-        # Расчет сроков поставки и оплаты
-        supply_days = deal_length_days - 30
-        payment_days = 30
-        
-        if supply_days < 0:
-            flash('Общая длина сделки не может быть меньше 30 дней.', 'danger')
-            return render_template('index.html', form_data=form_data)
-        
-        # Формируем текст для ячейки C10
-        product_with_drawing = product
-        if drawing_number:
-            product_with_drawing += f" ч.{drawing_number}"
-        
-        # Выполнение расчетов с учетом всех параметров бюджета
-        final_price = calculate_selling_price(
-            quantity=quantity,
-            purchase_cost=cost_price,
-            logistics_rub=logistics,
-            duty_percent=duty_percent,
-            weight=weight,
-            deal_length_days=deal_length_days,
-            margin_percent=30  # Целевая маржа 30%
-        )
+        try:
+            quote = build_quote(form_data, items)
+        except QuoteDataError as e:
+            g.outcome = 'invalid'
+            flash(str(e), 'danger')
+            return render_template('index.html', form_data=form_data, extra_items=extra_items)
         
-        # Проверка существования шаблонов
-        excel_template_path = os.path.join('templates_docs', 'template.xlsx')
-        word_template_path = os.path.join('templates_docs', 'template.docx')
+        # Такое же КП уже готовили: отдаем файл из хранилища
+        cache_key = _quote_cache_key(quote, formats)
+        record = quote_history.lookup(cache_key) if cache_key else None
+        if record is not None:
+            g.outcome = 'cached'
+            return send_file(
+                quote_history.path(record),
+                as_attachment=True,
+                download_name=record['file_name'],
+                mimetype=_mimetype(record['file_name'])
+            )
         
-        if not os.path.exists(excel_template_path):
-            flash('Шаблон Excel не найден. Обратитесь к администратору.', 'danger')
-            app.logger.error(f'Excel template not found: {excel_template_path}')
-            return render_template('index.html', form_data=form_data)
-            
-        if not os.path.exists(word_template_path):
-            flash('Шаблон Word не найден. Обратитесь к администратору.', 'danger')
-            app.logger.error(f'Word template not found: {word_template_path}')
-            return render_template('index.html', form_data=form_data)
+        # Шаблоны форматов, которые не запрошены, не загружаются и не заполняются
+        file_prefix = quote['file_prefix']
+        documents = []
         
         # Работа с Excel
-        try:
-            wb = load_workbook(excel_template_path)
-            ws = wb.active
-            
-            # Заполняем данные в Excel
-            current_date = datetime.now().strftime('%d.%m.%Yг.')
-            
-            # Основные данные
-            ws['D4'] = company
-            ws['C10'] = product_with_drawing  # Наименование товара с номером чертежа
-            ws['G10'] = quantity
-            ws['M10'] = cost_price
-            ws['P10'] = weight
-            ws['U14'] = logistics
-            ws['X10'] = duty_percent / 100  # Процент пошлины (доля)
-            ws['I15'] = supply_days  # Срок поставки
-            ws['I16'] = payment_days  # Срок оплаты
-            
-            # Дополнительные поля
-            ws['D2'] = current_date  # Дата формирования
-            ws['D5'] = tender_number  # Номер тендера
-            ws['D10'] = material  # Материал
-            ws['E10'] = drawing_number  # Номер чертежа
-            ws['P4'] = delivery_address  # Адрес доставки
-            
-            # Расчетные поля
-            ws['H10'] = final_price  # Финальная цена
-            
-            excel_file = BytesIO()
-            wb.save(excel_file)
-            excel_file.seek(0)
-        except Exception as e:
-            flash('Ошибка при обработке Excel-шаблона.', 'danger')
-            app.logger.error(f'Excel processing error: {str(e)}')
-            return render_template('index.html', form_data=form_data)
+        if 'xlsx' in formats:
+            try:
+                documents.append((f"{file_prefix}.xlsx",
+                                  render_excel(quote['excel_values'], quote['excel_items'])))
+            except FileNotFoundError:
+                flash('Шаблон Excel не найден. Обратитесь к администратору.', 'danger')
+                app.logger.error(f'Excel template not found: {EXCEL_TEMPLATE_PATH}')
+                return render_template('index.html', form_data=form_data, extra_items=extra_items)
+            except Exception as e:
+                flash('Ошибка при обработке Excel-шаблона.', 'danger')
+                app.logger.error(f'Excel processing error: {str(e)}')
+                return render_template('index.html', form_data=form_data, extra_items=extra_items)
         
         # Работа с Word
-        try:
-            doc = Document(word_template_path)
-            
-            # Форматируем текущую дату
-            current_date = datetime.now().strftime('%d.%m.%Yг.')
-            
-            word_data = {
-                '{{ company }}': company,
-                '{{ product }}': product,
-                '{{ quantity }}': str(quantity),
-                '{{ cost_price }}': f"{cost_price:.2f}",
-                '{{ weight }}': f"{weight:.2f}",
-                '{{ logistics }}': f"{logistics:.2f}",
-                '{{ final_price }}': f"{final_price:.2f}",
-                '{{ tender_number }}': tender_number,
-                '{{ drawing_number }}': drawing_number,
-                '{{ material }}': material,
-                '{{ delivery_address }}': delivery_address,
-                '{{ date }}': current_date,
-                '{{ duty_percent }}': f"{duty_percent:.1f}",
-                '{{ deal_length_days }}': str(deal_length_days),
-                '{{ supply_days }}': str(supply_days),
-                '{{ payment_days }}': str(payment_days),
-            }
-            
-            # Замена в параграфах
-            for paragraph in doc.paragraphs:
-                for key, value in word_data.items():
-                    if key in paragraph.text:
-                        paragraph.text = paragraph.text.replace(key, value)
-            
-            # Замена в таблицах
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        for key, value in word_data.items():
-                            if key in cell.text:
-                                cell.text = cell.text.replace(key, value)
-            
-            word_file = BytesIO()
-            doc.save(word_file)
-            word_file.seek(0)
-        except Exception as e:
-            flash('Ошибка при обработке Word-шаблона.', 'danger')
-            app.logger.error(f'Word processing error: {str(e)}')
-            return render_template('index.html', form_data=form_data)
+        if 'docx' in formats:
+            try:
+                documents.append((f"{file_prefix}.docx",
+                                  render_word(quote['word_values'], quote['word_items'])))
+            except FileNotFoundError:
+                flash('Шаблон Word не найден. Обратитесь к администратору.', 'danger')
+                app.logger.error(f'Word template not found: {WORD_TEMPLATE_PATH}')
+                return render_template('index.html', form_data=form_data, extra_items=extra_items)
+            except Exception as e:
+                flash('Ошибка при обработке Word-шаблона.', 'danger')
+                app.logger.error(f'Word processing error: {str(e)}')
+                return render_template('index.html', form_data=form_data, extra_items=extra_items)
         
-        # Создание ZIP-архива
-        file_prefix = f"КП_{get_safe_filename(company)}_{datetime.now().strftime('%Y%m%d_%H%M')}"
+        # Один документ отдается как есть, без архива
+        if len(documents) == 1:
+            download_name, data = documents[0]
+            if cache_key:
+                _save_history(cache_key, quote, download_name, data)
+            extension = download_name.rsplit('.', 1)[1]
+            g.outcome = 'ok'
+            return Response(data, mimetype=MIMETYPES[extension], headers={
+                'Content-Disposition': f"attachment; filename=quote.{extension}; filename*=UTF-8''{url_quote(download_name)}"
+            })
         
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Добавляем Excel-файл
-            zip_file.writestr(f"{file_prefix}.xlsx", excel_file.getvalue())
-            # Добавляем Word-файл
-            zip_file.writestr(f"{file_prefix}.docx", word_file.getvalue())
+        # ZIP-архив отдается по частям прямо из готовых файлов, без промежуточных копий;
+        # xlsx и docx уже сжаты и по умолчанию кладутся без повторного сжатия
+        with timed('zip'):
+            members = [ZipMember.from_bytes(name, data) for name, data in documents]
+            content_length = zip_size(members)
         
-        zip_buffer.seek(0)
+        download_name = f"{file_prefix}.zip"
+        if cache_key:
+            _save_history(cache_key, quote, download_name, iter_zip(members))
         
-        return send_file(
-            zip_buffer,
-            as_attachment=True,
-            download_name=f"{file_prefix}.zip",
-            mimetype='application/zip'
-        )
+        g.outcome = 'ok'
+        return Response(iter_zip(members), mimetype='application/zip', headers={
+            'Content-Length': str(content_length),
+            'Content-Disposition': f"attachment; filename=quote.zip; filename*=UTF-8''{url_quote(download_name)}"
+        })
     
     except Exception as e:
         flash('Произошла непредвиденная ошибка. Попробуйте еще раз.', 'danger')
         app.logger.error(f'Unexpected error: {str(e)}')
-        return render_template('index.html', form_data=form_data)
+        return render_template('index.html', form_data=form_data, extra_items=extra_items)
+
+@app.route('/api/price', methods=['POST'])
+def price():
+    """Расчет цены без документов, для показа цены в форме при вводе.
+    
+    Принимает поля формы или JSON с теми же полями; дополнительные позиции
+    в JSON передаются списком items. Время обработки — в заголовке Server-Timing.
+    """
+    started = time.perf_counter()
+    request_data = request.get_json(silent=True)
+    if isinstance(request_data, dict):
+        form_data = _string_fields(request_data)
+        extra_items = request_data.get('items') or []
+        if not isinstance(extra_items, list) or not all(isinstance(item, dict) for item in extra_items):
+            return jsonify({'errors': ['Поле "items" должно быть списком позиций.']}), 400
+        items = [form_data] + [_string_fields(item) for item in extra_items]
+    else:
+        form_data = request.form.to_dict()
+        items = items_from_form(request.form)
+    
+    errors = validate_form_data(form_data) + validate_items(items)
+    if not errors:
+        try:
+            result = price_quote(form_data, items)
+        except QuoteDataError as e:
+            # Нулевой общий вес, переполнение: цена не определена, JSON с NaN форма не разберет
+            errors = [str(e)]
+    if errors:
+        return jsonify({'errors': errors}), 400
+    
+    elapsed = (time.perf_counter() - started) * 1000
+    return jsonify(result), 200, {'Server-Timing': f'price;dur={elapsed:.3f}'}
+
+def _string_fields(data):
+    # Числа из JSON проверяются и разбираются так же, как строки формы
+    return {key: '' if value is None else str(value)
+            for key, value in data.items() if not isinstance(value, (list, dict))}
+
+def _save_history(cache_key, quote, file_name, data):
+    try:
+        quote_history.save(cache_key, quote, file_name, data)
+    except Exception as e:
+        app.logger.error(f'History save error: {str(e)}')
+
+def _mimetype(file_name):
+    return MIMETYPES.get(file_name.rsplit('.', 1)[-1], 'application/octet-stream')
+
+@app.route('/generate/batch', methods=['POST'])
+def generate_batch():
+    """Пакетная генерация: таблица CSV/XLSX со строками КП -> один ZIP-архив"""
+    upload = request.files.get('batch_file')
+    if not upload or not upload.filename:
+        flash('Выберите файл CSV или XLSX со строками КП.', 'danger')
+        return render_template('index.html')
+    
+    try:
+        rows = read_rows(upload.read(), upload.filename)
+    except Exception as e:
+        flash('Не удалось прочитать файл. Проверьте формат CSV/XLSX.', 'danger')
+        app.logger.error(f'Batch file read error: {str(e)}')
+        return render_template('index.html')
+    
+    if len(rows) > BATCH_MAX_ROWS:
+        flash(f'В файле {len(rows)} строк, за один раз можно не больше {BATCH_MAX_ROWS}. '
+              f'Разделите файл на части.', 'danger')
+        return render_template('index.html')
+    
+    # Все строки проверяются до начала генерации
+    valid, errors = validate_rows(rows)
+    if not valid:
+        flash('В файле нет ни одной корректной строки.', 'danger')
+        for row_number, error in errors[:20]:
+            flash(f'Строка {row_number}: {error}', 'danger')
+        return render_template('index.html')
+    
+    report = BatchReport(len(rows))
+    workers = int(os.environ.get('KP_BATCH_WORKERS', 0)) or None
+    
+    def stream():
+        yield from iter_batch_zip(valid, errors, workers=workers, report=report)
+        app.logger.info(f'Batch generated: {report.summary()}')
+    
+    download_name = f"КП_пакет_{datetime.now().strftime('%Y%m%d_%H%M')}.zip"
+    return Response(stream(), mimetype='application/zip', headers={
+        'Content-Disposition': f"attachment; filename=batch.zip; filename*=UTF-8''{url_quote(download_name)}"
+    })
+
+def _quote_cache_key(quote, formats):
+    try:
+        return quote_key(quote, formats)
+    except OSError:
+        # Без шаблона ключа нет; ошибку покажет генерация
+        return None
+
+@app.route('/api/history')
+def history_search():
+    """Поиск в истории КП: company, tender_number, date_from, date_to (ГГГГ-ММ-ДД)"""
+    try:
+        records = quote_history.search(
+            company=request.args.get('company'),
+            tender_number=request.args.get('tender_number'),
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            # SQLite считает LIMIT -1 неограниченным: граница с обеих сторон
+            limit=max(1, min(request.args.get('limit', 50, type=int), 500)),
+        )
+    except ValueError:
+        return jsonify({'errors': ['Даты указываются в формате ГГГГ-ММ-ДД.']}), 400
+    for record in records:
+        record['download_url'] = url_for('history_download', record_id=record['id'])
+    return jsonify({'quotes': records, 'stats': quote_history.stats()})
+
+@app.route('/history/<int:record_id>/download')
+def history_download(record_id):
+    """Повторная загрузка КП из хранилища без генерации"""
+    record = quote_history.get(record_id)
+    if record is None or not os.path.exists(quote_history.path(record)):
+        return jsonify({'errors': ['КП не найдено в истории.']}), 404
+    return send_file(
+        quote_history.path(record),
+        as_attachment=True,
+        download_name=record['file_name'],
+        mimetype=_mimetype(record['file_name'])
+    )
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Ставит генерацию КП в очередь; поля те же, что у /generate"""
+    form_data = request.form.to_dict()
+    items = items_from_form(request.form)
+    errors = validate_form_data(form_data) + validate_items(items)
+    if errors:
+        return jsonify({'errors': errors}), 400
+    
+    try:
+        job = job_queue.submit(form_data, items)
+    except QueueFullError as e:
+        return jsonify({'errors': [str(e)]}), 503, {'Retry-After': RETRY_AFTER}
+    
+    return jsonify(_job_response(job)), 202, {'Location': url_for('job_status', job_id=job.id)}
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'errors': ['Задание не найдено.']}), 404
+    return jsonify(_job_response(job))
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'errors': ['Задание не найдено.']}), 404
+    if job.status != DONE:
+        # Результат еще не готов или задание завершилось ошибкой
+        return jsonify(_job_response(job)), 409
+    
+    return send_file(
+        BytesIO(job.result),
+        as_attachment=True,
+        download_name=f"{job.file_prefix}.zip",
+        mimetype='application/zip'
+    )
+
+@app.route('/api/jobs/stats')
+def jobs_stats():
+    """Глубина очереди и время ожидания заданий для подбора размера пула"""
+    return jsonify(job_queue.stats())
+
+@app.route('/api/admission/stats')
+def admission_stats():
+    """Занятые места и очередь генерации в этом процессе (pid), число отказов"""
+    return jsonify({**admission.stats(), 'pid': os.getpid()})
+
+def _job_response(job):
+    response = job.to_dict()
+    response['status_url'] = url_for('job_status', job_id=job.id)
+    response['result_url'] = url_for('job_result', job_id=job.id)
+    return response
+
+@app.route('/api/scenarios', methods=['POST'])
+def scenarios():
+    """Сетка сценариев цены по диапазонам маржи, пошлины, длины сделки, курса и ставки"""
+    request_data = request.get_json(silent=True)
+    output = request.args.get('format') or (request_data or {}).get('format') or 'json'
+    if output not in ('json', 'csv', 'xlsx'):
+        return jsonify({'errors': [f'Неизвестный формат "{output}": json, csv или xlsx.']}), 400
+    
+    try:
+        grid = build_grid(request_data)
+        if output == 'xlsx':
+            download_name = scenario_filename('xlsx')
+            return Response(grid.to_xlsx(), headers={
+                'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                'Content-Disposition': f"attachment; filename=scenarios.xlsx; filename*=UTF-8''{url_quote(download_name)}"
+            })
+    except ScenarioError as e:
+        return jsonify({'errors': [str(e)]}), 400
+    
+    app.logger.info(f'Scenario grid: {grid.size} points, shape {list(grid.shape)}')
+    if output == 'csv':
+        download_name = scenario_filename('csv')
+        return Response(grid.iter_csv(), mimetype='text/csv', headers={
+            'Content-Disposition': f"attachment; filename=scenarios.csv; filename*=UTF-8''{url_quote(download_name)}"
+        })
+    return Response(grid.iter_json(), mimetype='application/json')
+
+@app.route('/api/templates/stats')
+def templates_stats():
+    """Счетчики кэша шаблонов для контроля под нагрузкой"""
+    return jsonify(templates.stats())
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -296,9 +513,9 @@ def internal_error(error):
     return render_template('500.html'), 500
 
 if __name__ == '__main__':
-    # Создаем необходимые папки при запуске
+    # Запуск для разработки; в продакшне — python server.py (см. info.txt)
     for folder in ['logs', 'templates_docs']:
         if not os.path.exists(folder):
             os.makedirs(folder)
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=os.environ.get('KP_DEBUG') == '1', host='0.0.0.0', port=5000)
\ No newline at end of file
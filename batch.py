@@ -0,0 +1,240 @@
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+
+from quotes import process_context, render_quote, validate_form_data, validate_quote, warm_templates
+from zipstream import ZipMember, iter_zip
+
+# Пакетная генерация КП: одна строка входной таблицы — одно КП.
+# Столбцы таблицы называются так же, как поля формы index.html.
+
+BATCH_FIELDS = ('company', 'product', 'quantity', 'cost_price', 'weight', 'logistics',
+                'tender_number', 'drawing_number', 'material', 'delivery_address',
+                'duty_percent', 'deal_length_days')
+
+# Строк в одном пакете: по два документа на строку, а архив без ZIP64 вмещает
+# не больше 65535 файлов и 4 ГБ; проверяется до начала генерации
+BATCH_MAX_ROWS = int(os.environ.get('KP_BATCH_MAX_ROWS', 10000))
+
+
+class BatchReport:
+    """Итоги пакетной генерации, заполняются по мере записи архива"""
+
+    def __init__(self, total_rows):
+        self.total_rows = total_rows
+        self.generated = 0
+        self.errors = []  # (номер строки, текст ошибки)
+        self.elapsed = 0.0
+
+    @property
+    def quotes_per_second(self):
+        return self.generated / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def failed_rows(self):
+        return len({row_number for row_number, _ in self.errors})
+
+    def summary(self):
+        return (f'{self.generated} of {self.total_rows} quotes, {self.failed_rows} failed rows, '
+                f'{self.elapsed:.2f}s, {self.quotes_per_second:.1f} quotes/s')
+
+
+def read_rows(data, filename):
+    """Читает строки CSV или XLSX; возвращает список (номер строки в файле, данные формы)"""
+    if filename.lower().endswith(('.xlsx', '.xlsm')):
+        return _read_xlsx_rows(data)
+    return _read_csv_rows(data)
+
+
+def validate_rows(rows):
+    """Проверяет все строки заранее; возвращает (корректные строки, ошибки)"""
+    valid, errors = [], []
+    for row_number, form_data in rows:
+        row_errors = validate_form_data(form_data) or validate_quote(form_data)
+        if row_errors:
+            errors.extend((row_number, error) for error in row_errors)
+        else:
+            valid.append((row_number, form_data))
+    return valid, errors
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def iter_batch_zip(rows, errors=(), workers=None, report=None):
+    """Генерирует КП для строк rows и отдает ZIP-архив по частям.
+
+    КП готовятся параллельно в пуле процессов и попадают в архив по мере
+    готовности; одновременно в работе не больше двух КП на процесс, поэтому
+    память не растет с размером пакета. Ошибки отдельных строк не прерывают
+    пакет и попадают в report.csv в конце архива.
+    """
+    total_rows = len(rows) + len({row for row, _ in errors})
+    if total_rows > BATCH_MAX_ROWS:
+        # До первого байта архива: оборванный архив клиент принял бы за готовый
+        raise ValueError(f'Batch of {total_rows} rows exceeds KP_BATCH_MAX_ROWS={BATCH_MAX_ROWS}')
+    workers = workers or default_workers()
+    report = report or BatchReport(total_rows)
+    report.errors.extend(errors)
+
+    def members():
+        started = time.perf_counter()
+        statuses = {}
+        for row_number, error in report.errors:
+            if row_number in statuses:
+                statuses[row_number] += f'; {error}'
+            else:
+                statuses[row_number] = f'error: {error}'
+
+        for row_number, result in _render_rows(rows, workers):
+            if isinstance(result, Exception):
+                report.errors.append((row_number, str(result)))
+                statuses[row_number] = f'error: {result}'
+                continue
+            file_prefix, excel_bytes, word_bytes = result
+            name = f'{row_number:04d}_{file_prefix}'
+            yield ZipMember.from_bytes(f'{name}.xlsx', excel_bytes)
+            yield ZipMember.from_bytes(f'{name}.docx', word_bytes)
+            report.generated += 1
+            statuses[row_number] = f'ok: {name}'
+            report.elapsed = time.perf_counter() - started
+
+        report.elapsed = time.perf_counter() - started
+        yield ZipMember.from_bytes('report.csv', _report_csv(statuses, report))
+
+    return iter_zip(members())
+
+
+def _render_rows(rows, workers):
+    """Отдает (номер строки, результат или исключение) в порядке готовности"""
+    if workers == 1:
+        for row_number, form_data in rows:
+            yield row_number, _render_safely(form_data)
+        return
+
+    pending = {}
+    queue = iter(rows)
+    # Строка таблицы — КП с одной позицией: снимки openpyxl процессам не нужны
+    initializer = partial(warm_templates, multi_item=False)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_context(),
+                             initializer=initializer) as pool:
+        def submit_next():
+            item = next(queue, None)
+            if item is not None:
+                row_number, form_data = item
+                pending[pool.submit(render_quote, form_data)] = row_number
+
+        for _ in range(workers * 2):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                row_number = pending.pop(future)
+                try:
+                    yield row_number, future.result()
+                except Exception as e:
+                    yield row_number, e
+                submit_next()
+
+
+def _render_safely(form_data):
+    try:
+        return render_quote(form_data)
+    except Exception as e:
+        return e
+
+
+def _report_csv(statuses, report):
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=';')
+    writer.writerow(['row', 'status'])
+    for row_number in sorted(statuses):
+        writer.writerow([row_number, statuses[row_number]])
+    writer.writerow([])
+    writer.writerow(['summary', report.summary()])
+    # BOM, чтобы Excel открыл файл в UTF-8
+    return ('\ufeff' + out.getvalue()).encode('utf-8')
+
+
+def _read_csv_rows(data):
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Excel с русской локалью сохраняет CSV в cp1251
+        text = data.decode('cp1251')
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=';,\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    rows = []
+    # Строка 1 — заголовок, данные начинаются со строки 2
+    for row_number, record in enumerate(reader, start=2):
+        form_data = {field: _cell_text(record.get(field)) for field in BATCH_FIELDS}
+        if any(form_data.values()):
+            rows.append((row_number, form_data))
+    return rows
+
+
+def _read_xlsx_rows(data):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        lines = wb.active.iter_rows(values_only=True)
+        header = [_cell_text(value) for value in next(lines, ())]
+        rows = []
+        for row_number, values in enumerate(lines, start=2):
+            record = dict(zip(header, values))
+            form_data = {field: _cell_text(record.get(field)) for field in BATCH_FIELDS}
+            if any(form_data.values()):
+                rows.append((row_number, form_data))
+        return rows
+    finally:
+        wb.close()
+
+
+def _cell_text(value):
+    """Значение ячейки в виде строки, как если бы оно пришло из формы"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # 3.0 из Excel должно остаться допустимым количеством
+        return str(int(value))
+    return str(value).strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Пакетная генерация КП из таблицы CSV/XLSX')
+    parser.add_argument('input', help='файл CSV или XLSX со столбцами ' + ', '.join(BATCH_FIELDS))
+    parser.add_argument('-o', '--output', default='КП_пакет.zip', help='путь к ZIP-архиву')
+    parser.add_argument('-w', '--workers', type=int, default=default_workers(),
+                        help='число процессов (по умолчанию — число ядер)')
+    args = parser.parse_args(argv)
+
+    with open(args.input, 'rb') as f:
+        rows = read_rows(f.read(), args.input)
+    if len(rows) > BATCH_MAX_ROWS:
+        print(f'{len(rows)} rows, at most {BATCH_MAX_ROWS} per batch (KP_BATCH_MAX_ROWS)', file=sys.stderr)
+        return 1
+    valid, errors = validate_rows(rows)
+    for row_number, error in errors:
+        print(f'row {row_number}: {error}', file=sys.stderr)
+
+    report = BatchReport(len(rows))
+    with open(args.output, 'wb') as out:
+        for chunk in iter_batch_zip(valid, errors, workers=args.workers, report=report):
+            out.write(chunk)
+
+    print(report.summary())
+    return 0 if report.generated else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Сверка расчета цен с формулами бюджета и замер вычислителя формул листа.
+
+Запуск из корня проекта: python benchmarks/bench_budget.py
+Для случайных КП цены price_items подставляются в лист Бюджет.xltx и в
+шаблон template.xlsx; маржинальный доход по формулам листа должен быть
+равен целевой марже. Печатает время компиляции формул, полного и
+инкрементального пересчета. Код выхода 1 при расхождении.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ooxml_fill import read_active_sheet
+from quotes import (EXCEL_ITEM_ROW, EXCEL_MARGIN_CELL, EXCEL_TEMPLATE_PATH, MARGIN_PERCENT,
+                    build_quote)
+from sheet_formulas import SheetFormulas
+from sheet_rows import shift_reference
+
+BUDGET_PATH = os.path.join('templates_docs', 'Бюджет.xltx')
+
+
+def random_quote(rng, count):
+    form = {'company': 'Бенчмарк', 'logistics': str(rng.randint(0, 500000)),
+            'deal_length_days': str(rng.randint(30, 365)), 'duty_percent': str(rng.choice((0, 5, 10)))}
+    items = [{'product': f'Позиция {n}', 'quantity': str(rng.randint(1, 500)),
+              'cost_price': f'{rng.uniform(10, 100000):.2f}', 'weight': f'{rng.uniform(0.1, 500):.2f}',
+              'duty_percent': rng.choice(('', '0', '7.5'))} for n in range(count)]
+    return build_quote(form, items)
+
+
+def sheet_inputs(quote):
+    extra_rows = len(quote['excel_items']) - 1
+    cells = {shift_reference(ref, EXCEL_ITEM_ROW, extra_rows): value
+             for ref, value in quote['excel_values'].items()}
+    for number, item in enumerate(quote['excel_items']):
+        for column, value in item.items():
+            cells[f'{column}{EXCEL_ITEM_ROW + number}'] = value
+    return cells
+
+
+def check_agreement(sheet, cases=300, seed=1):
+    rng = random.Random(seed)
+    mismatches = []
+    for _ in range(cases):
+        quote = random_quote(rng, rng.choice((1, 1, 2, 5, 20)))
+        extra_rows = len(quote['excel_items']) - 1
+        evaluator = sheet.with_item_rows(EXCEL_ITEM_ROW, extra_rows).evaluator(sheet_inputs(quote))
+        margin = evaluator[shift_reference(EXCEL_MARGIN_CELL, EXCEL_ITEM_ROW, extra_rows)]
+        if not isinstance(margin, float) or abs(margin - MARGIN_PERCENT / 100) > 1e-9:
+            mismatches.append((len(quote['excel_items']), margin))
+    return mismatches
+
+
+def best_time(func, repeat=200):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    failed = False
+    for path in (BUDGET_PATH, EXCEL_TEMPLATE_PATH):
+        with open(path, 'rb') as f:
+            data = f.read()
+        started = time.perf_counter()
+        sheet = SheetFormulas(**read_active_sheet(data))
+        compile_time = time.perf_counter() - started
+        print(f'{path}: {len(sheet.order)} формул, компиляция {compile_time * 1000:.1f} мс')
+        if sheet.unsupported:
+            print(f'  не поддерживаются: {sheet.unsupported}')
+
+        mismatches = check_agreement(sheet)
+        print(f'  расхождений с price_items: {len(mismatches)}')
+        if mismatches:
+            failed = True
+            print(f'  например: {mismatches[:5]}')
+
+        quote = random_quote(random.Random(2), 1)
+        inputs = sheet_inputs(quote)
+        evaluator = sheet.evaluator(inputs)
+        price = inputs[f'H{EXCEL_ITEM_ROW}']
+        prices = iter(range(10 ** 9))
+        print(f'  полный пересчет:        {best_time(lambda: sheet.evaluate(inputs)) * 1e6:8.1f} мкс')
+        print(f'  новый вычислитель:      {best_time(lambda: sheet.evaluator(inputs)) * 1e6:8.1f} мкс')
+        print(f'  изменение цены H{EXCEL_ITEM_ROW}:     '
+              f'{best_time(lambda: evaluator.set({f"H{EXCEL_ITEM_ROW}": price + next(prices)})) * 1e6:8.1f} мкс '
+              f'({len(sheet.affected([f"H{EXCEL_ITEM_ROW}"]))} формул)')
+        for count in (10, 50):
+            started = time.perf_counter()
+            expanded = sheet.with_item_rows(EXCEL_ITEM_ROW, count - 1)
+            print(f'  {count} позиций: компиляция {(time.perf_counter() - started) * 1000:.1f} мс, '
+                  f'{len(expanded.order)} формул')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
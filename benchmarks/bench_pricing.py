@@ -0,0 +1,110 @@
+"""Замер векторного расчета цен для КП с большим числом позиций.
+
+Запуск из корня проекта: python benchmarks/bench_pricing.py
+Сравнивает price_items с прежним скалярным расчетом (копия формулы
+calculate_selling_price до перехода на numpy) и проверяет, что для одной
+позиции цены совпадают до последнего бита. Код выхода 1 при расхождении.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pricing import price_items
+
+
+def scalar_price(quantity, purchase_cost, logistics_rub, duty_percent, weight, deal_length_days=170, margin_percent=30):
+    """Прежний расчет цены одной позиции на скалярах, без изменений"""
+    # Константы из бюджета
+    CONVERSION_RATE = 12  # Курс юаня к рублю
+    LOGISTICS_CNR_RATIO = 0.3  # Доля логистики КНР
+    LOGISTICS_RF_RATIO = 0.7  # Доля логистики РФ
+    CONVERSION_FEE_RATE = 0.032  # Комиссия за конвертацию 3.2%
+    CREDIT_RATE = 0.16  # Ставка кредита 16%
+    
+    # Расчет общего веса
+    total_weight = weight * quantity
+    
+    # Перевод логистики в юани и распределение по весу
+    logistics_total_yuan = logistics_rub / CONVERSION_RATE
+    
+    # Расчет логистики на единицу товара (пропорционально весу)
+    logistics_cnr_per_unit = (logistics_total_yuan * LOGISTICS_CNR_RATIO * weight) / total_weight
+    logistics_rf_per_unit = (logistics_total_yuan * LOGISTICS_RF_RATIO * weight) / total_weight
+    
+    # Расчет пошлины на единицу товара
+    duty_per_unit = (purchase_cost + logistics_cnr_per_unit) * (duty_percent / 100)
+    
+    # Расчет стоимости конвертации
+    conversion_fee = purchase_cost * quantity * CONVERSION_FEE_RATE
+    conversion_fee_per_unit = conversion_fee / quantity
+    
+    # Расчет кредитных затрат
+    credit_cost = purchase_cost * quantity * CREDIT_RATE / 365 * deal_length_days
+    credit_cost_per_unit = credit_cost / quantity
+    
+    # Общие затраты на единицу товара
+    total_cost_per_unit = (
+        purchase_cost +
+        logistics_cnr_per_unit +
+        logistics_rf_per_unit +
+        duty_per_unit +
+        conversion_fee_per_unit +
+        credit_cost_per_unit
+    )
+    
+    # Расчет цены для маржи margin_percent%
+    selling_price_per_unit = total_cost_per_unit / (1 - margin_percent / 100)
+    
+    return selling_price_per_unit
+
+
+def random_items(count, seed=1):
+    rng = random.Random(seed)
+    return ([rng.randint(1, 500) for _ in range(count)],
+            [rng.uniform(10, 100000) for _ in range(count)],
+            [rng.uniform(0.01, 500) for _ in range(count)],
+            [rng.choice((0, 5, 7.5, 10)) for _ in range(count)])
+
+
+def check_single_item(cases=2000):
+    quantities, costs, weights, duties = random_items(cases, seed=2)
+    rng = random.Random(3)
+    mismatches = 0
+    for quantity, cost, weight, duty in zip(quantities, costs, weights, duties):
+        logistics, days = rng.uniform(0, 500000), rng.randint(30, 365)
+        vector = price_items([quantity], [cost], [weight], logistics, [duty], days, 30)[0]
+        scalar = scalar_price(quantity, cost, logistics, duty, weight, days, 30)
+        mismatches += vector != scalar
+    return mismatches
+
+
+def best_time(func, repeat=20):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    mismatches = check_single_item()
+    print(f'расхождений для одной позиции: {mismatches}')
+    print(f'{"позиций":>8} {"векторно, мс":>13} {"поштучно, мс":>13}')
+    for count in (1, 10, 100, 1000, 10000):
+        quantities, costs, weights, duties = random_items(count)
+        vector = best_time(lambda: price_items(quantities, costs, weights, 150000, duties))
+        # Поштучный расчет как ориентир: логистика на каждую позицию целиком
+        scalar = best_time(lambda: [
+            scalar_price(q, c, 150000, d, w)
+            for q, c, w, d in zip(quantities, costs, weights, duties)
+        ], repeat=3)
+        print(f'{count:>8} {vector * 1000:>13.3f} {scalar * 1000:>13.3f}')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
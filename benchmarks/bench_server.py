@@ -0,0 +1,263 @@
+"""Проверка продакшн-запуска: время старта и поведение при перегрузке.
+
+Запуск из корня проекта (Linux/macOS): python benchmarks/bench_server.py
+Замеряет импорт приложения в чистом процессе и время от запуска server.py
+до первого ответа, затем сравнивает первый /generate с последующими (шаблоны
+должны быть разобраны до открытия порта). После этого одновременно шлет
+--burst запросов /generate при малом лимите генераций: лишние запросы должны
+быстро получить 503 с Retry-After, допущенные — готовый архив, а после
+нагрузки места генерации должны освободиться. Наконец, завершает рабочий
+процесс сигналом SIGTERM (как при плановой замене): записи лога из нового
+процесса должны по-прежнему попадать в файл. Код выхода 1, если проверка
+не прошла.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+
+FORM = {
+    'company': 'ООО Ромашка', 'logistics': '150000', 'delivery_address': 'Москва',
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_import():
+    """Время import app в новом процессе интерпретатора, с"""
+    code = ('import time; started = time.perf_counter(); import app; '
+            'print(time.perf_counter() - started)')
+    env = dict(os.environ, KP_DATA_DIR=tempfile.mkdtemp(prefix='kp_bench_'))
+    output = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.split()[-1])
+
+
+class Server:
+    """server.py в дочернем процессе на свободном порту"""
+
+    def __init__(self, **env):
+        self.port = free_port()
+        self.env = dict(os.environ, KP_BIND=f'127.0.0.1:{self.port}',
+                        KP_DATA_DIR=tempfile.mkdtemp(prefix='kp_bench_'), **env)
+        self.process = None
+
+    def start(self, timeout=60):
+        """Запускает сервер и ждет первого ответа; возвращает время старта, с"""
+        started = time.perf_counter()
+        self.process = subprocess.Popen([sys.executable, 'server.py'], env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        while time.perf_counter() - started < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'server.py exited: {self.process.stderr.read().decode()[-2000:]}')
+            try:
+                self.get('/api/admission/stats')
+                return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f'server.py did not answer in {timeout} s')
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+
+    def get(self, path):
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.port}{path}', timeout=5) as response:
+            return json.load(response)
+
+    def post_json(self, path, data):
+        request = urllib.request.Request(f'http://127.0.0.1:{self.port}{path}',
+                                         data=json.dumps(data).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.read()
+
+    def generate(self, items=1, tag=''):
+        """POST /generate; возвращает (код ответа, время, заголовки, тело)"""
+        data = [(key, value) for key, value in FORM.items()]
+        data.append(('tender_number', f'BENCH-{tag}-{time.perf_counter_ns()}'))
+        for index in range(items):
+            data += [('product', f'Позиция {index}'), ('quantity', str(index % 7 + 1)),
+                     ('cost_price', str(1000 + index * 10)), ('weight', '2'), ('duty_percent', '5')]
+        request = urllib.request.Request(f'http://127.0.0.1:{self.port}/generate',
+                                         data=urllib.parse.urlencode(data).encode())
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                body = response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status, headers = e.code, e.headers
+        return status, time.perf_counter() - started, headers, body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def check_startup(args):
+    failures = []
+    import_time = measure_import()
+    print(f'import app: {import_time * 1000:.0f} мс')
+
+    # Несколько процессов — только без /jobs (см. server.py)
+    with Server(KP_WORKERS=str(args.workers), KP_JOBS='0') as server:
+        ready = server.start()
+        print(f'server.py, {args.workers} процесса: первый ответ через {ready * 1000:.0f} мс')
+        if ready > args.max_startup:
+            failures.append(f'startup {ready:.2f} s > {args.max_startup} s')
+
+        # Первые запросы попадают в свежие рабочие процессы; КП с несколькими
+        # позициями заполняются через openpyxl/python-docx, их снимки тоже
+        # должны быть готовы до открытия порта
+        for items in (1, 2):
+            first = [server.generate(items=items, tag='first')[1] for _ in range(args.workers)]
+            steady = [server.generate(items=items, tag='steady')[1] for _ in range(10)]
+            median = statistics.median(steady)
+            print(f'/generate, позиций {items}: первые {", ".join(f"{t * 1000:.0f}" for t in first)} мс, '
+                  f'дальше медиана {median * 1000:.0f} мс')
+            if max(first) > median + args.first_request_slack:
+                failures.append(f'first /generate with {items} item(s) {max(first):.3f} s, '
+                                f'steady {median:.3f} s')
+    return failures
+
+
+def check_overload(args):
+    failures = []
+    env = {'KP_WORKERS': '1', 'KP_MAX_RENDERS': str(args.max_renders),
+           'KP_RENDER_QUEUE': str(args.render_queue), 'KP_THREADS': str(args.burst + 2)}
+    with Server(**env) as server:
+        server.start()
+        barrier = threading.Barrier(args.burst)
+        results = []
+        def client(number):
+            barrier.wait()
+            results.append(server.generate(items=args.items, tag=str(number)))
+        threads = [threading.Thread(target=client, args=(number,)) for number in range(args.burst)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Место освобождается при закрытии ответа, уже после того, как клиент дочитал тело
+        deadline = time.perf_counter() + 2
+        stats = server.get('/api/admission/stats')
+        while (stats['active'] or stats['waiting']) and time.perf_counter() < deadline:
+            time.sleep(0.05)
+            stats = server.get('/api/admission/stats')
+
+    admitted = [result for result in results if result[0] == 200]
+    rejected = [result for result in results if result[0] == 503]
+    print(f'{args.burst} одновременных /generate при {args.max_renders} местах и очереди '
+          f'{args.render_queue}: 200 — {len(admitted)}, 503 — {len(rejected)}')
+    if admitted:
+        print(f'  допущенные: медиана {statistics.median(r[1] for r in admitted) * 1000:.0f} мс, '
+              f'максимум {max(r[1] for r in admitted) * 1000:.0f} мс')
+    if rejected:
+        print(f'  отказы: медиана {statistics.median(r[1] for r in rejected) * 1000:.0f} мс, '
+              f'максимум {max(r[1] for r in rejected) * 1000:.0f} мс')
+    print(f'  после нагрузки: {stats}')
+
+    if len(admitted) + len(rejected) != args.burst:
+        failures.append(f'unexpected status codes: {sorted({r[0] for r in results})}')
+    if len(admitted) < args.max_renders + args.render_queue:
+        failures.append(f'only {len(admitted)} requests admitted')
+    if not rejected:
+        failures.append('no request was rejected')
+    if any(r[2].get_content_type() != 'application/zip' for r in admitted):
+        failures.append('admitted request without ZIP archive')
+    if any(r[2].get('Retry-After') is None for r in rejected):
+        failures.append('503 without Retry-After')
+    if rejected and max(r[1] for r in rejected) > args.max_reject_time:
+        failures.append(f'slow 503: {max(r[1] for r in rejected):.3f} s')
+    if stats['active'] or stats['waiting']:
+        failures.append(f'render slots not released: {stats}')
+    return failures
+
+
+def check_worker_restart(args):
+    """Записи лога доходят до файла и после замены рабочего процесса"""
+    failures = []
+    log_file = os.path.join(tempfile.mkdtemp(prefix='kp_bench_'), 'kp_generator.log')
+    scenario = {'quantity': 3, 'cost_price': 35000, 'weight': 200, 'logistics': 150000,
+                'parameters': {'margin_percent': [20, 30]}}
+
+    def logged():
+        # Каждый запрос /api/scenarios пишет в лог строку "Scenario grid"
+        deadline = time.perf_counter() + 2
+        while True:
+            with open(log_file, encoding='utf-8') as f:
+                count = f.read().count('Scenario grid')
+            if count >= expected or time.perf_counter() > deadline:
+                return count
+            time.sleep(0.05)
+
+    with Server(KP_WORKERS='1', KP_LOG_FILE=log_file) as server:
+        server.start()
+        for expected in range(1, args.restarts + 2):
+            if expected > 1:
+                pid = server.get('/api/admission/stats')['pid']
+                os.kill(pid, signal.SIGTERM)
+                deadline = time.perf_counter() + 30
+                while time.perf_counter() < deadline:
+                    try:
+                        if server.get('/api/admission/stats')['pid'] != pid:
+                            break
+                    except OSError:
+                        pass
+                    time.sleep(0.05)
+                else:
+                    failures.append(f'worker {pid} was not replaced')
+                    break
+            server.post_json('/api/scenarios', scenario)
+            count = logged()
+            if count < expected:
+                failures.append(f'log record lost after {expected - 1} worker restart(s)')
+                break
+    print(f'замена рабочего процесса по SIGTERM ({args.restarts} раза): '
+          f'{"записи лога теряются" if failures else "лог пишется"}')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-startup', type=float, default=10.0, help='секунд до первого ответа')
+    parser.add_argument('--first-request-slack', type=float, default=0.25,
+                        help='насколько первый /generate может быть медленнее медианы, с')
+    parser.add_argument('--burst', type=int, default=16)
+    parser.add_argument('--items', type=int, default=20, help='позиций в КП при перегрузке')
+    parser.add_argument('--max-renders', type=int, default=2)
+    parser.add_argument('--render-queue', type=int, default=2)
+    parser.add_argument('--max-reject-time', type=float, default=0.5, help='секунд на ответ 503')
+    parser.add_argument('--restarts', type=int, default=2, help='замен рабочего процесса')
+    args = parser.parse_args(argv)
+
+    failures = check_startup(args) + check_overload(args) + check_worker_restart(args)
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
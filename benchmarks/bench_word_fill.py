@@ -0,0 +1,82 @@
+"""Замер подстановки плейсхолдеров Word на документах разного размера.
+
+Запуск из корня проекта: python benchmarks/bench_word_fill.py
+Время на абзац должно оставаться примерно постоянным при росте документа.
+"""
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docx import Document
+
+from word_fill import fill_document, index_placeholders
+
+FIELDS = ('company', 'product', 'quantity', 'final_price', 'material', 'tender_number',
+          'drawing_number', 'delivery_address')
+VALUES = {name: f'значение {name}' for name in FIELDS}
+
+
+def build_document(paragraphs):
+    """Документ с paragraphs абзацами и таблицей; каждый пятый абзац с плейсхолдером"""
+    doc = Document()
+    for number in range(paragraphs):
+        paragraph = doc.add_paragraph(f'Абзац {number} ')
+        if number % 5 == 0:
+            # Плейсхолдер, разбитый на несколько run, как это делает Word
+            name = FIELDS[number % len(FIELDS)]
+            paragraph.add_run('{{ ')
+            paragraph.add_run(name).bold = True
+            paragraph.add_run(' }}')
+    table = doc.add_table(rows=max(paragraphs // 10, 1), cols=4)
+    for row in table.rows:
+        row.cells[0].merge(row.cells[1])
+        row.cells[2].text = '{{ quantity }} шт.'
+    doc.sections[0].footer.paragraphs[0].text = '{{ company }}'
+    return doc
+
+
+def legacy_fill(doc, values):
+    """Прежний способ из generate(): абзацы × ключи с присваиванием paragraph.text"""
+    word_data = {f'{{{{ {name} }}}}': value for name, value in values.items()}
+    for paragraph in doc.paragraphs:
+        for key, value in word_data.items():
+            if key in paragraph.text:
+                paragraph.text = paragraph.text.replace(key, value)
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for key, value in word_data.items():
+                    if key in cell.text:
+                        cell.text = cell.text.replace(key, value)
+
+
+def measure(fill, template, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        doc = copy.deepcopy(template)
+        started = time.perf_counter()
+        fill(doc)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    print(f'{"абзацев":>8} {"legacy, мс":>11} {"fill, мс":>9} {"индекс, мс":>11} {"мкс/абзац":>10}')
+    for paragraphs in (100, 400, 1600, 6400):
+        template = build_document(paragraphs)
+        index = index_placeholders(template)
+        repeat = 5 if paragraphs <= 1600 else 2
+        # Прежний способ растет квадратично, на больших документах его не ждем
+        legacy = measure(lambda doc: legacy_fill(doc, VALUES), template, 1) if paragraphs <= 1600 else None
+        plain = measure(lambda doc: fill_document(doc, VALUES), template, repeat)
+        indexed = measure(lambda doc: fill_document(doc, VALUES, index), template, repeat)
+        legacy = f'{legacy * 1000:.1f}' if legacy is not None else '—'
+        print(f'{paragraphs:>8} {legacy:>11} {plain * 1000:>9.1f} '
+              f'{indexed * 1000:>11.1f} {indexed * 1e6 / paragraphs:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
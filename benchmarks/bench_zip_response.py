@@ -0,0 +1,80 @@
+"""Замер памяти и времени упаковки ответа /generate в ZIP.
+
+Запуск из корня проекта: python benchmarks/bench_zip_response.py
+Сравнивает прежнюю упаковку (BytesIO на каждый файл, копии через getvalue()
+и ZIP_DEFLATED в третий BytesIO) с потоковой отдачей iter_zip, где xlsx и
+docx кладутся без повторного сжатия. Пиковая память считается через
+tracemalloc от момента, когда оба документа уже сгенерированы.
+"""
+import os
+import sys
+import time
+import tracemalloc
+import zipfile
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quotes import build_quote, render_excel, render_word
+from zipstream import ZipMember, iter_zip
+
+FORM = {
+    'company': 'ООО Ромашка', 'product': 'Вал', 'quantity': '3', 'cost_price': '35000',
+    'weight': '200', 'logistics': '150000', 'duty_percent': '5', 'tender_number': 'T-1',
+}
+
+
+def legacy_response(excel_bytes, word_bytes, file_prefix):
+    """Прежний конец generate(): три буфера и повторное сжатие"""
+    excel_file = BytesIO(excel_bytes)
+    word_file = BytesIO(word_bytes)
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(f'{file_prefix}.xlsx', excel_file.getvalue())
+        zip_file.writestr(f'{file_prefix}.docx', word_file.getvalue())
+    zip_buffer.seek(0)
+    # send_file отдает файл блоками, как и Response с генератором
+    sent = 0
+    for chunk in iter(lambda: zip_buffer.read(8192), b''):
+        sent += len(chunk)
+    return sent
+
+
+def streamed_response(excel_bytes, word_bytes, file_prefix):
+    members = [
+        ZipMember.from_bytes(f'{file_prefix}.xlsx', excel_bytes),
+        ZipMember.from_bytes(f'{file_prefix}.docx', word_bytes),
+    ]
+    return sum(len(chunk) for chunk in iter_zip(members))
+
+
+def measure(respond, excel_bytes, word_bytes, file_prefix, repeat=20):
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    size = respond(excel_bytes, word_bytes, file_prefix)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        respond(excel_bytes, word_bytes, file_prefix)
+        best = min(best, time.perf_counter() - started)
+    return size, peak, best
+
+
+def main():
+    print(f'{"позиций":>8} {"способ":>10} {"архив, КБ":>10} {"пик памяти, КБ":>15} {"время, мс":>10}')
+    for count in (1, 50):
+        items = [dict(FORM, product=f'Позиция {n}') for n in range(count)]
+        quote = build_quote(FORM, items)
+        excel_bytes = render_excel(quote['excel_values'], quote['excel_items'])
+        word_bytes = render_word(quote['word_values'], quote['word_items'])
+        for label, respond in (('legacy', legacy_response), ('stream', streamed_response)):
+            size, peak, best = measure(respond, excel_bytes, word_bytes, quote['file_prefix'])
+            print(f'{count:>8} {label:>10} {size / 1024:>10.1f} {peak / 1024:>15.1f} {best * 1000:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
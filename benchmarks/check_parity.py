@@ -0,0 +1,136 @@
+"""Сверка движков заполнения шаблонов: ooxml и openpyxl/python-docx.
+
+Запуск из корня проекта: python benchmarks/check_parity.py
+Одни и те же КП с одной позицией заполняются обоими движками
+(quotes.RENDER_ENGINE). В xlsx сравниваются значения и формулы всех ячеек
+всех листов и сохраненные значения формул, в docx — тексты всех абзацев
+основного текста, таблиц, колонтитулов и сносок. Текст с управляющими
+символами (\v из Word и подобные) оба движка должны отклонять, а проверка
+формы — не пропускать. Код выхода 1 при расхождении.
+"""
+import os
+import random
+import re
+import sys
+import zipfile
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree
+from openpyxl import load_workbook
+
+import quotes
+from quotes import build_quote, render_excel, render_word, validate_form_data
+
+ENGINES = ('ooxml', 'openpyxl')
+
+# Управляющие символы, недопустимые в XML; \v Word вставляет по Shift+Enter
+CONTROL_CHARACTERS = ('\x0b', '\x0c', '\x00', '\x1f')
+
+# Части docx с текстом: основной текст, колонтитулы, сноски
+WORD_STORY = re.compile(r'word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$')
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def random_form(rng):
+    form = {
+        'company': rng.choice(('ООО Ромашка', 'АО "Вектор" & Ко', 'ИП <Иванов>', '  Пробелы  ')),
+        'product': rng.choice(('Вал', 'Ось 40Х', 'Фланец Ø120', 'Деталь "А"')),
+        'quantity': str(rng.randint(1, 500)),
+        'cost_price': f'{rng.uniform(10, 100000):.2f}',
+        'weight': f'{rng.uniform(0.1, 500):.2f}',
+        'logistics': str(rng.randint(0, 500000)),
+        'deal_length_days': rng.choice(('', str(rng.randint(30, 365)))),
+        'duty_percent': rng.choice(('', '0', '5', '7.5')),
+    }
+    for field in ('tender_number', 'drawing_number', 'material', 'delivery_address'):
+        form[field] = rng.choice(('', f'{field}-{rng.randint(1, 999)}', 'г. Москва, ул. Ленина, д. 1'))
+    return form
+
+
+def render(quote, engine):
+    quotes.RENDER_ENGINE = engine
+    return (render_excel(quote['excel_values'], quote['excel_items']),
+            render_word(quote['word_values'], quote['word_items']))
+
+
+def sheet_cells(data):
+    """{(лист, строка, столбец): (значение или формула, сохраненное значение)} для непустых ячеек"""
+    formulas = load_workbook(BytesIO(data), read_only=True)
+    cached = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    cells = {}
+    for ws in formulas.worksheets:
+        rows = zip(ws.iter_rows(values_only=True), cached[ws.title].iter_rows(values_only=True))
+        for row, (values, cached_values) in enumerate(rows, start=1):
+            for column, cell in enumerate(zip(values, cached_values), start=1):
+                if cell != (None, None):
+                    cells[(ws.title, row, column)] = cell
+    return cells
+
+
+def word_texts(data):
+    """{часть docx: [текст каждого абзаца]}"""
+    texts = {}
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        for name in archive.namelist():
+            if WORD_STORY.match(name):
+                root = etree.fromstring(archive.read(name))
+                texts[name] = [''.join(node.text or '' for node in paragraph.iter(f'{W}t'))
+                               for paragraph in root.iter(f'{W}p')]
+    return texts
+
+
+def check_control_characters():
+    """Список проблем с текстом, который нельзя записать в XML документа"""
+    problems = []
+    for char in CONTROL_CHARACTERS:
+        form = {'company': f'ООО{char}Ромашка', 'product': 'Вал', 'quantity': '2',
+                'cost_price': '1000', 'weight': '5', 'logistics': '150000'}
+        if not validate_form_data(form):
+            problems.append(f'validation accepts {char!r}')
+        quote = build_quote(form)
+        for engine in ENGINES:
+            quotes.RENDER_ENGINE = engine
+            for name, render_document, values, items in (
+                    ('xlsx', render_excel, quote['excel_values'], quote['excel_items']),
+                    ('docx', render_word, quote['word_values'], quote['word_items'])):
+                try:
+                    render_document(values, items)
+                except Exception:
+                    continue
+                problems.append(f'{engine} writes {char!r} into {name}')
+    return problems
+
+
+def compare(expected, actual):
+    """Список различий двух словарей: (ключ, ожидаемое, полученное)"""
+    return [(key, expected.get(key), actual.get(key))
+            for key in sorted(set(expected) | set(actual), key=str)
+            if expected.get(key) != actual.get(key)]
+
+
+def main(cases=20, seed=1):
+    rng = random.Random(seed)
+    engine = quotes.RENDER_ENGINE
+    failures = 0
+    try:
+        for number in range(cases):
+            quote = build_quote(random_form(rng))
+            (excel_a, word_a), (excel_b, word_b) = (render(quote, name) for name in ENGINES)
+            differences = (compare(sheet_cells(excel_a), sheet_cells(excel_b)) +
+                           compare(word_texts(word_a), word_texts(word_b)))
+            if differences:
+                failures += 1
+                print(f'КП {number}: {len(differences)} расхождений, например: {differences[:3]}')
+        problems = check_control_characters()
+    finally:
+        quotes.RENDER_ENGINE = engine
+    print(f'КП с расхождениями движков {" и ".join(ENGINES)}: {failures} из {cases}')
+    print(f'управляющие символы: {"; ".join(problems) if problems else "отклоняются обоими движками"}')
+    return 1 if failures or problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
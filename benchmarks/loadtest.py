@@ -0,0 +1,345 @@
+"""Нагрузочные замеры конвейера генерации КП с проверкой регрессий.
+
+Запуск из корня проекта:
+    python benchmarks/loadtest.py                     # все сценарии, сравнение с baseline.json
+    python benchmarks/loadtest.py --quick             # короткий прогон
+    python benchmarks/loadtest.py --only generate     # сценарии, в имени которых есть "generate"
+    python benchmarks/loadtest.py --update-baseline   # записать результаты как новый baseline
+
+Сценарии гоняют /generate через тестовый клиент Flask (с разным числом
+позиций и параллельных клиентов), а расчет цены и заполнение шаблонов
+вызывают напрямую (с разным числом позиций, плейсхолдеров и размером
+документа). Для каждого сценария считаются p50/p95/p99 задержки, КП в
+секунду и пиковый RSS процесса. Результаты пишутся в JSON; если есть
+baseline, команда завершается с кодом 1, когда сценарий хуже baseline
+больше, чем на --tolerance.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+# Хранилище готовых КП на время замеров — во временном каталоге
+os.environ.setdefault('KP_DATA_DIR', tempfile.mkdtemp(prefix='kp_bench_'))
+# Замеряется пропускная способность, а не отказы при перегрузке (см. bench_server.py)
+os.environ.setdefault('KP_RENDER_QUEUE', '64')
+
+BASELINE_PATH = os.path.join('benchmarks', 'baseline.json')
+RESULTS_PATH = os.path.join('benchmarks', 'results.json')
+
+FORM = {
+    'company': 'ООО Ромашка', 'product': 'Вал', 'quantity': '3', 'cost_price': '35000',
+    'weight': '200', 'logistics': '150000', 'duty_percent': '5', 'tender_number': 'T-1',
+    'drawing_number': '123', 'material': 'Ст.40', 'delivery_address': 'Москва',
+}
+
+
+class RssSampler:
+    """Пиковый RSS процесса за время работы, по опросу /proc/self/statm"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        # Не Linux: пик за все время процесса (ru_maxrss в КБ)
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Scenario:
+    """Сценарий замера: operation(номер запроса) выполняется requests раз в concurrency потоках.
+
+    С setup замеряется operation(setup(номер)): подготовка в задержку не входит.
+    """
+
+    def __init__(self, name, operation, requests, concurrency=1, warmup=2, setup=None):
+        self.name = name
+        self.operation = operation
+        self.requests = requests
+        self.concurrency = concurrency
+        self.warmup = warmup
+        self.setup = setup
+
+    def run(self):
+        return run_scenario(self.name, self.operation, self.requests, self.concurrency,
+                            self.warmup, self.setup)
+
+
+def run_scenario(name, operation, requests, concurrency=1, warmup=2, setup=None):
+    """Выполняет operation(номер) requests раз в concurrency потоках и собирает статистику"""
+    setup = setup or (lambda number: number)
+    for number in range(warmup):
+        operation(setup(-1 - number))
+
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        while True:
+            with lock:
+                number = next(counter, None)
+            if number is None:
+                return
+            argument = setup(number)
+            started = time.perf_counter()
+            operation(argument)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+    return {
+        'name': name,
+        'requests': requests,
+        'concurrency': concurrency,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 4),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 4),
+        'quotes_per_second': round(requests / wall, 2),
+        'peak_rss_mb': round(rss.peak / 2 ** 20, 1),
+    }
+
+
+def generate_scenarios(quick):
+    """/generate через тестовый клиент: число позиций × параллельные клиенты"""
+    from werkzeug.datastructures import MultiDict
+
+    from app import app
+    from quotes import MIMETYPES
+
+    app.logger.disabled = True
+
+    def form(items, number, **fields):
+        data = MultiDict({key: value for key, value in FORM.items() if key not in
+                          ('product', 'quantity', 'cost_price', 'weight', 'duty_percent',
+                           'drawing_number', 'material')})
+        # Уникальный номер тендера, чтобы каждый запрос действительно генерировал КП
+        data['tender_number'] = f'BENCH-{number}-{time.perf_counter_ns()}'
+        data.update(fields)
+        for index in range(items):
+            data.add('product', f'Позиция {index}')
+            data.add('drawing_number', f'Ч-{index}')
+            data.add('material', 'Ст.45')
+            data.add('quantity', str(index % 7 + 1))
+            data.add('cost_price', str(1000 + index * 10))
+            data.add('weight', str(1 + index % 5))
+            data.add('duty_percent', '5')
+        return data
+
+    def post(data, url='/generate', mimetype='application/zip'):
+        client = app.test_client()
+        response = client.post(url, data=data)
+        body = response.get_data()
+        response.close()
+        if response.status_code != 200 or response.mimetype != mimetype:
+            raise RuntimeError(f'{url} returned {response.status_code} {response.mimetype}')
+        return body
+
+    requests = 20 if quick else 100
+    for items in (1, 10, 50):
+        for concurrency in ((1, 4) if quick else (1, 4, 8)):
+            if items > 10 and concurrency > 1 and quick:
+                continue
+            yield Scenario(
+                f'generate items={items} concurrency={concurrency}',
+                lambda number, items=items: post(form(items, number)),
+                requests if items < 50 else max(requests // 4, 5), concurrency)
+
+    # Один формат: второй шаблон и архив не нужны
+    for name, mimetype in MIMETYPES.items():
+        if name != 'zip':
+            yield Scenario(
+                f'generate formats={name}',
+                lambda number, name=name, mimetype=mimetype: post(
+                    form(1, number, formats=name), mimetype=mimetype),
+                requests)
+
+    # Повтор одинакового запроса отдается из хранилища готовых КП
+    cached = form(1, 0)
+    yield Scenario('generate cached', lambda number: post(cached), requests)
+
+    # Живая цена в форме: только проверка и расчет
+    for items in (1, 50):
+        yield Scenario(
+            f'api price items={items}',
+            lambda number, data=form(items, 0): post(data, '/api/price', 'application/json'),
+            requests * 10)
+
+
+def pricing_scenarios(quick):
+    """Векторный расчет цен для разного числа позиций"""
+    import numpy as np
+
+    from pricing import price_items
+
+    rng = np.random.default_rng(1)
+    for items in (1, 100, 10000):
+        quantities = rng.integers(1, 500, items)
+        costs = rng.uniform(10, 1e5, items)
+        weights = rng.uniform(0.01, 500, items)
+        yield Scenario(
+            f'pricing items={items}',
+            lambda number, q=quantities, c=costs, w=weights: price_items(q, c, w, 150000, 5),
+            200 if quick else 1000)
+
+
+def fill_scenarios(quick):
+    """Заполнение шаблонов: реальные шаблоны обоими способами и синтетические документы Word"""
+    from docx import Document
+
+    import quotes
+    from word_fill import fill_document, index_placeholders
+
+    quote = quotes.build_quote(FORM)
+    requests = 30 if quick else 150
+    for engine in ('ooxml', 'openpyxl'):
+        def render(number, engine=engine):
+            previous, quotes.RENDER_ENGINE = quotes.RENDER_ENGINE, engine
+            try:
+                quotes.render_excel(quote['excel_values'], quote['excel_items'])
+                quotes.render_word(quote['word_values'], quote['word_items'])
+            finally:
+                quotes.RENDER_ENGINE = previous
+        yield Scenario(f'render templates engine={engine}', render,
+                       requests if engine == 'ooxml' else max(requests // 5, 5))
+
+    values = {f'field{index}': f'значение {index}' for index in range(200)}
+    for paragraphs, placeholders in ((200, 20), (200, 200), (2000, 20), (2000, 200)):
+        template = Document()
+        step = max(paragraphs // placeholders, 1)
+        for number in range(paragraphs):
+            paragraph = template.add_paragraph(f'Абзац {number} ')
+            if number % step == 0:
+                # Плейсхолдер, разбитый на несколько run, как это делает Word
+                paragraph.add_run('{{ ')
+                paragraph.add_run(f'field{(number // step) % len(values)}').bold = True
+                paragraph.add_run(' }}')
+        index = index_placeholders(template)
+        # Заполненный документ больше не содержит плейсхолдеров, поэтому копия на каждый запрос
+        yield Scenario(
+            f'word fill paragraphs={paragraphs} placeholders={placeholders}',
+            lambda doc, index=index: fill_document(doc, values, index),
+            10 if quick else 30, setup=lambda number, template=template: copy.deepcopy(template))
+
+
+SUITES = (pricing_scenarios, generate_scenarios, fill_scenarios)
+
+
+def compare(results, baseline, tolerance):
+    """Список регрессий: задержка p95 и RSS выросли или скорость упала больше tolerance"""
+    previous = {scenario['name']: scenario for scenario in baseline['scenarios']}
+    regressions = []
+    for scenario in results['scenarios']:
+        base = previous.get(scenario['name'])
+        if base is None:
+            continue
+        if scenario['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{scenario['name']}: p95 {base['p95_ms']} -> {scenario['p95_ms']} ms")
+        if scenario['quotes_per_second'] < base['quotes_per_second'] * (1 - tolerance):
+            regressions.append(f"{scenario['name']}: {base['quotes_per_second']} -> "
+                               f"{scenario['quotes_per_second']} quotes/s")
+        # Небольшие колебания RSS (до 16 МБ) не считаем регрессией
+        if scenario['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance) + 16:
+            regressions.append(f"{scenario['name']}: peak RSS {base['peak_rss_mb']} -> "
+                               f"{scenario['peak_rss_mb']} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочные замеры генерации КП')
+    parser.add_argument('--quick', action='store_true', help='меньше повторов и сценариев')
+    parser.add_argument('--only', help='запускать только сценарии, в имени которых есть эта строка')
+    parser.add_argument('--output', default=RESULTS_PATH, help='куда записать результаты JSON')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='допустимое ухудшение относительно baseline (0.25 = 25%%)')
+    parser.add_argument('--update-baseline', action='store_true', help='записать результаты в baseline')
+    args = parser.parse_args(argv)
+
+    print(f'{"сценарий":<48} {"p50, мс":>9} {"p95, мс":>9} {"p99, мс":>9} {"КП/с":>10} {"RSS, МБ":>8}')
+    scenarios = []
+    for suite in SUITES:
+        for spec in suite(args.quick):
+            if args.only and args.only not in spec.name:
+                continue
+            scenario = spec.run()
+            scenarios.append(scenario)
+            print(f"{scenario['name']:<48} {scenario['p50_ms']:>9.3f} {scenario['p95_ms']:>9.3f} "
+                  f"{scenario['p99_ms']:>9.3f} {scenario['quotes_per_second']:>10.1f} "
+                  f"{scenario['peak_rss_mb']:>8.1f}")
+
+    results = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'quick': args.quick,
+        'scenarios': scenarios,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f'baseline записан: {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'baseline {args.baseline} нет, сравнение пропущено (--update-baseline, чтобы создать)')
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    print(f'{len(regressions)} регрессий относительно {args.baseline} (допуск {args.tolerance:.0%})')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
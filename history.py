@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from pricing import PRICING_CONSTANTS
+from quotes import EXCEL_TEMPLATE_PATH, WORD_TEMPLATE_PATH, FORMATS, templates
+
+# История КП и кэш готовых архивов.
+# Ключ архива — хэш нормализованных значений, которые попадают в документы
+# (результат build_quote), констант расчета и версий шаблонов. Одинаковый
+# запрос отдается из хранилища без повторной генерации. Архивы лежат на
+# диске под своим ключом, а SQLite хранит историю для поиска и вытеснения.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    company TEXT NOT NULL,
+    company_search TEXT NOT NULL,
+    tender_number TEXT NOT NULL,
+    created TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    file_name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    final_price REAL,
+    items INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS quotes_company ON quotes (company_search);
+CREATE INDEX IF NOT EXISTS quotes_tender ON quotes (tender_number);
+CREATE INDEX IF NOT EXISTS quotes_created ON quotes (created);
+CREATE INDEX IF NOT EXISTS quotes_last_used ON quotes (last_used);
+'''
+
+HISTORY_COLUMNS = ('id', 'company', 'tender_number', 'created', 'file_name', 'size',
+                   'final_price', 'items', 'hits')
+
+
+TEMPLATE_PATHS = {'xlsx': EXCEL_TEMPLATE_PATH, 'docx': WORD_TEMPLATE_PATH}
+
+
+def quote_key(quote, formats=FORMATS):
+    """Ключ кэша для результата build_quote и набора форматов документов.
+
+    Имя файла с отметкой времени в ключ не входит; дата документа входит,
+    поэтому повторный запрос в тот же день попадает в кэш, а на следующий —
+    получает документ с новой датой.
+    """
+    canonical = {
+        'excel_values': quote['excel_values'],
+        'excel_items': quote['excel_items'],
+        'word_values': quote['word_values'],
+        'word_items': quote['word_items'],
+        'pricing': PRICING_CONSTANTS,
+        'templates': [templates.version(TEMPLATE_PATHS[name]) for name in formats],
+    }
+    if tuple(formats) != FORMATS:
+        # Архив с обоими документами сохраняет прежний ключ
+        canonical['formats'] = list(formats)
+    data = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class QuoteHistory:
+    """История КП в SQLite и хранилище архивов на диске.
+
+    Хранится не больше max_items архивов общим размером не больше max_bytes;
+    при превышении удаляются давно не использованные.
+    """
+
+    def __init__(self, root, max_items=50, max_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.db_path = os.path.join(root, 'history.sqlite3')
+        self.artifacts = os.path.join(root, 'artifacts')
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evicted': 0}
+
+        os.makedirs(self.artifacts, exist_ok=True)
+        with closing(self._connect()) as db:
+            db.executescript(SCHEMA)
+
+    def lookup(self, key):
+        """Запись истории для ключа, если архив есть в хранилище, иначе None"""
+        with closing(self._connect()) as db, db:
+            row = db.execute('SELECT * FROM quotes WHERE key = ?', (key,)).fetchone()
+            if row is None or not os.path.exists(self.path(row)):
+                self._count('misses')
+                return None
+            db.execute('UPDATE quotes SET last_used = ?, hits = hits + 1 WHERE id = ?',
+                       (time.time(), row['id']))
+        self._count('hits')
+        return dict(row)
+
+    def save(self, key, quote, file_name, data):
+        """Сохраняет архив (или отдельный документ) и запись истории; возвращает запись.
+
+        data — байты файла или итератор его частей (например, iter_zip);
+        расширение файла в хранилище берется из file_name.
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = [data]
+        path = os.path.join(self.artifacts, key + os.path.splitext(file_name)[1])
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        size = 0
+        with open(tmp_path, 'wb') as f:
+            for chunk in data:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+
+        company = quote['company']
+        tender_number = quote['excel_values'].get('D5', '')
+        now = time.time()
+        with self._lock, closing(self._connect()) as db, db:
+            db.execute(
+                'INSERT INTO quotes (key, company, company_search, tender_number, created, last_used,'
+                ' file_name, size, final_price, items) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+                ' ON CONFLICT(key) DO UPDATE SET last_used = excluded.last_used,'
+                ' file_name = excluded.file_name, size = excluded.size',
+                (key, company, company.casefold(), tender_number,
+                 datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S'), now,
+                 file_name, size, quote['final_price'], len(quote['excel_items'])))
+            self._evict(db)
+            row = db.execute('SELECT * FROM quotes WHERE key = ?', (key,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get(self, record_id):
+        with closing(self._connect()) as db:
+            row = db.execute('SELECT * FROM quotes WHERE id = ?', (record_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def path(self, record):
+        return os.path.join(self.artifacts, record['key'] + os.path.splitext(record['file_name'])[1])
+
+    def search(self, company=None, tender_number=None, date_from=None, date_to=None, limit=50):
+        """Поиск по подстроке названия компании, номеру тендера и датам (ГГГГ-ММ-ДД)"""
+        where, params = [], []
+        if company:
+            where.append('instr(company_search, ?) > 0')
+            params.append(company.strip().casefold())
+        if tender_number:
+            where.append('tender_number = ?')
+            params.append(tender_number.strip())
+        if date_from:
+            where.append('created >= ?')
+            params.append(_parse_date(date_from).strftime('%Y-%m-%d'))
+        if date_to:
+            # Дата "по" включительно
+            where.append('created < ?')
+            params.append((_parse_date(date_to) + timedelta(days=1)).strftime('%Y-%m-%d'))
+        sql = f'SELECT {", ".join(HISTORY_COLUMNS)} FROM quotes'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY created DESC, id DESC LIMIT ?'
+        params.append(limit)
+        with closing(self._connect()) as db:
+            return [dict(row) for row in db.execute(sql, params)]
+
+    def stats(self):
+        with closing(self._connect()) as db:
+            count, size = db.execute('SELECT count(*), coalesce(sum(size), 0) FROM quotes').fetchone()
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update({'stored': count, 'bytes': size,
+                      'max_items': self.max_items, 'max_bytes': self.max_bytes})
+        return stats
+
+    def _evict(self, db):
+        """Удаляет давно не использованные архивы сверх лимитов; вызывается под self._lock"""
+        count, size = db.execute('SELECT count(*), coalesce(sum(size), 0) FROM quotes').fetchone()
+        victims = []
+        for row in db.execute('SELECT id, key, size, file_name FROM quotes ORDER BY last_used'):
+            if count <= self.max_items and size <= self.max_bytes:
+                break
+            victims.append(row)
+            count -= 1
+            size -= row['size']
+        for row in victims:
+            db.execute('DELETE FROM quotes WHERE id = ?', (row['id'],))
+            try:
+                os.remove(self.path(row))
+            except FileNotFoundError:
+                pass
+        self._counters['evicted'] += len(victims)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=10)
+        db.row_factory = sqlite3.Row
+        return db
+
+
+def _parse_date(value):
+    # ValueError для неверного формата обрабатывает вызывающий код
+    return datetime.strptime(value.strip(), '%Y-%m-%d')
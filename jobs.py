@@ -0,0 +1,259 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from history import quote_key
+from quotes import QuoteDataError, build_quote, process_context, render_quote, warm_templates
+from zipstream import ZipMember, build_zip
+
+# Фоновая генерация КП: запрос ставит задание в очередь и сразу получает id,
+# а ограниченный пул исполнителей готовит документы. Статус и результат
+# забираются по id. Очередь считает глубину и время ожидания заданий,
+# чтобы по ним подбирать размер пула.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFullError(RuntimeError):
+    """Очередь заданий заполнена, новое задание не принято"""
+
+
+class Job:
+    """Задание на генерацию одного КП"""
+
+    def __init__(self, form_data, items=None):
+        self.id = uuid.uuid4().hex
+        self.form_data = form_data
+        self.items = items
+        self.status = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.file_prefix = None
+        self.result = None  # байты ZIP-архива
+
+    @property
+    def wait_time(self):
+        """Время в очереди до начала работы, с"""
+        end = self.started if self.started is not None else time.time()
+        return end - self.submitted
+
+    @property
+    def run_time(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'wait_time': round(self.wait_time, 4),
+            'run_time': round(self.run_time, 4) if self.run_time is not None else None,
+            'error': self.error,
+            'file_name': f'{self.file_prefix}.zip' if self.file_prefix else None,
+        }
+
+
+class JobQueue:
+    """Очередь заданий с пулом из workers исполнителей.
+
+    executor='thread' готовит КП в потоках процесса приложения,
+    executor='process' — в отдельных процессах (по одному на исполнителя).
+    Очередь ограничена max_queued заданиями; готовые задания хранятся
+    result_ttl секунд и не больше max_finished штук. С history (QuoteHistory)
+    уже готовые КП отдаются из хранилища, а новые сохраняются в него.
+    """
+
+    def __init__(self, workers=None, executor='thread', max_queued=100,
+                 result_ttl=3600, max_finished=200, history=None, logger=None):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f'Unknown job executor: {executor}')
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = executor
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+        self.history = history
+        self.logger = logger
+
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._finished = deque()  # id готовых заданий в порядке завершения
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pool = None
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+        self._waits = deque(maxlen=1000)  # время ожидания последних начатых заданий
+        self._max_wait = 0.0
+
+    def submit(self, form_data, items=None):
+        """Ставит КП в очередь и возвращает задание; QueueFullError, если мест нет"""
+        self._start()
+        job = Job(form_data, items)
+        with self._lock:
+            self._evict()
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+                self.rejected += 1
+            raise QueueFullError('Очередь генерации заполнена, повторите позже.')
+        with self._lock:
+            self.submitted += 1
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict()
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        """Глубина очереди, загрузка пула и время ожидания заданий"""
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                'executor': self.executor,
+                'workers': self.workers,
+                'queue_depth': self._queue.qsize(),
+                'queue_limit': self.max_queued,
+                'running': self.running,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+                'stored': len(self._jobs),
+                'wait_seconds': {
+                    'p50': _percentile(waits, 0.5),
+                    'p95': _percentile(waits, 0.95),
+                    'max': round(self._max_wait, 4),
+                },
+            }
+
+    def _start(self):
+        # Пул запускается при первом задании, а не при импорте приложения
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            if self.executor == 'process':
+                # Не fork: у процесса приложения есть потоки, см. process_context
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=process_context(),
+                                                 initializer=warm_templates)
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'kp-job-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                job.started = time.time()
+                job.status = RUNNING
+                self.running += 1
+                self._waits.append(job.wait_time)
+                self._max_wait = max(self._max_wait, job.wait_time)
+            try:
+                file_prefix, result = self._render(job)
+            except Exception as e:
+                self._finish(job, error=e)
+            else:
+                self._finish(job, file_prefix=file_prefix, result=result)
+            finally:
+                self._queue.task_done()
+
+    def _render(self, job):
+        key = quote = None
+        if self.history is not None:
+            quote = build_quote(job.form_data, job.items)
+            key = quote_key(quote)
+            record = self.history.lookup(key)
+            if record is not None:
+                with open(self.history.path(record), 'rb') as f:
+                    return record['file_name'][:-len('.zip')], f.read()
+
+        if self._pool is not None:
+            file_prefix, result = self._pool.submit(render_job, job.form_data, job.items).result()
+        else:
+            file_prefix, result = render_job(job.form_data, job.items)
+
+        if key is not None:
+            try:
+                self.history.save(key, quote, f'{file_prefix}.zip', result)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f'History save error: {str(e)}')
+        return file_prefix, result
+
+    def _finish(self, job, file_prefix=None, result=None, error=None):
+        with self._lock:
+            job.finished = time.time()
+            job.file_prefix = file_prefix
+            job.result = result
+            self.running -= 1
+            if error is None:
+                job.status = DONE
+                self.completed += 1
+            else:
+                job.status = FAILED
+                job.error = _error_message(error)
+                self.failed += 1
+            self._finished.append(job.id)
+        if error is not None and self.logger:
+            self.logger.error(f'Job {job.id} failed: {str(error)}')
+
+    def _evict(self):
+        """Удаляет устаревшие готовые задания; вызывается под self._lock"""
+        now = time.time()
+        while self._finished:
+            job = self._jobs.get(self._finished[0])
+            expired = job is None or now - job.finished > self.result_ttl
+            if not expired and len(self._finished) <= self.max_finished:
+                break
+            self._finished.popleft()
+            if job is not None:
+                del self._jobs[job.id]
+
+
+def render_job(form_data, items=None):
+    """Готовит КП и упаковывает его в ZIP; возвращает (префикс имени, байты архива)"""
+    file_prefix, excel_bytes, word_bytes = render_quote(form_data, items)
+    archive = build_zip([
+        ZipMember.from_bytes(f'{file_prefix}.xlsx', excel_bytes),
+        ZipMember.from_bytes(f'{file_prefix}.docx', word_bytes),
+    ])
+    return file_prefix, archive
+
+
+def _error_message(error):
+    if isinstance(error, QuoteDataError):
+        return str(error)
+    if isinstance(error, FileNotFoundError):
+        return 'Шаблон не найден. Обратитесь к администратору.'
+    return 'Ошибка при генерации КП.'
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * fraction))], 4)
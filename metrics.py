@@ -0,0 +1,167 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+# Метрики приложения в текстовом формате Prometheus.
+# Счетчики, гистограммы и текущие значения хранятся в памяти процесса;
+# render() отдает их для /metrics.
+
+# Границы корзин гистограмм времени, с
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric:
+    """Метрика с набором меток; значения хранятся по кортежу значений меток"""
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{self._label_text(key)} {_number(value)}']
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счетчики по корзинам, сумма, количество]
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]])
+                           for key, state in self._values.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{self._label_text(key, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{self.name}_bucket{self._label_text(key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{self._label_text(key)} {_number(total)}')
+            lines.append(f'{self.name}_count{self._label_text(key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'kp_stage_seconds', 'Duration of quote generation stages.', ('stage',)))
+REQUEST_SECONDS = registry.register(Histogram(
+    'kp_request_seconds', 'Duration of HTTP requests.', ('endpoint',)))
+REQUESTS = registry.register(Counter(
+    'kp_requests_total', 'HTTP requests by endpoint and outcome.', ('endpoint', 'outcome')))
+RESPONSE_BYTES = registry.register(Counter(
+    'kp_response_bytes_total', 'Bytes of generated documents and archives sent.', ('endpoint',)))
+IN_FLIGHT = registry.register(Gauge(
+    'kp_requests_in_flight', 'HTTP requests being processed.', ('endpoint',)))
+
+# Поток, в котором этапы сейчас не замеряются (см. untimed)
+_untimed = threading.local()
+
+
+def timed(stage):
+    """Контекстный менеджер: время этапа stage попадает в kp_stage_seconds"""
+    if getattr(_untimed, 'active', False):
+        return nullcontext()
+    return STAGE_SECONDS.time(stage=stage)
+
+
+@contextmanager
+def untimed():
+    """Этапы внутри блока не попадают в kp_stage_seconds: прогрев при старте — не запросы"""
+    previous = getattr(_untimed, 'active', False)
+    _untimed.active = True
+    try:
+        yield
+    finally:
+        _untimed.active = previous
+
+
+def _number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
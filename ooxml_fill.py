@@ -0,0 +1,343 @@
+import math
+import posixpath
+import re
+import zipfile
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from lxml import etree
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.formula.translate import Translator
+from openpyxl.utils.exceptions import IllegalCharacterError
+
+from sheet_formulas import CellError
+from word_fill import W_P, WORD_STORY_RE, replace_placeholders
+from zipstream import ZipMember, build_zip, read_members
+
+# Заполнение шаблонов на уровне ZIP/XML без openpyxl и python-docx.
+# Шаблон разбирается один раз: все неизменяемые элементы архива сохраняются
+# в сжатом виде и копируются побайтно, а изменяемые XML-части хранятся как
+# список статичных фрагментов и слотов для подстановки значений.
+
+SHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+DOC_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+# Маркеры слотов из области частного использования Unicode: в шаблонах не встречаются
+_SLOT_OPEN = '\ue000'
+_SLOT_CLOSE = '\ue001'
+_SLOT_RE = re.compile(f'{_SLOT_OPEN}(\\w+){_SLOT_CLOSE}')
+
+# Ячейка листа с формулой: адрес и элемент f (значение v после него заменяется)
+FORMULA_CELL_RE = re.compile(r'<c r="([A-Z]+\d+)"[^>]*?>(<f(?:\s[^>]*)?(?:/>|>[^<]*</f>))(?:<v>[^<]*</v>|<v/>)?</c>')
+
+
+class FillPlan:
+    """Скомпилированный шаблон: элементы архива и слоты изменяемых частей"""
+
+    def __init__(self, members, parts):
+        self.members = members  # list[ZipMember], None на месте изменяемых частей
+        self.parts = parts  # {индекс элемента: (имя, фрагменты, ключи слотов)}
+
+    def render(self, render_slot):
+        """Собирает архив, подставляя render_slot(key) в каждый слот"""
+        return build_zip(self.render_members(render_slot))
+
+    def render_members(self, render_slot):
+        """Элементы архива с подставленными значениями, без сборки самого архива"""
+        members = list(self.members)
+        for index, (name, chunks, keys) in self.parts.items():
+            out = [chunks[0]]
+            for key, chunk in zip(keys, chunks[1:]):
+                out.append(render_slot(key))
+                out.append(chunk)
+            members[index] = ZipMember.from_bytes(name, ''.join(out).encode('utf-8'))
+        return members
+
+
+class WorkbookPlan(FillPlan):
+    """План заполнения ячеек активного листа книги Excel"""
+
+    def __init__(self, members, parts, styles, formulas=None):
+        super().__init__(members, parts)
+        self.styles = styles  # {адрес ячейки: атрибут стиля s}
+        self.formulas = formulas or {}  # {адрес ячейки с формулой: XML элемента f}
+
+    def fill(self, values, formula_values=None):
+        """Возвращает байты xlsx, где ячейки из values заменены новыми значениями"""
+        return build_zip(self.fill_members(values, formula_values))
+
+    def fill_members(self, values, formula_values=None):
+        """Элементы архива с новыми значениями ячеек.
+
+        formula_values — вычисленные значения формул; без них у формул
+        не остается устаревших значений шаблона.
+        """
+        formula_values = formula_values or {}
+        def render_cell(ref):
+            formula = self.formulas.get(ref)
+            if formula is not None:
+                return _formula_cell_xml(ref, self.styles[ref], formula, formula_values.get(ref))
+            return _cell_xml(ref, self.styles[ref], values.get(ref))
+        return self.render_members(render_cell)
+
+
+class DocumentPlan(FillPlan):
+    """План подстановки значений в плейсхолдеры {{ name }} документа Word"""
+
+    def fill(self, values):
+        """Возвращает байты docx с подставленными значениями"""
+        return build_zip(self.fill_members(values))
+
+    def fill_members(self, values):
+        def render_value(name):
+            return _run_text_xml(str(values.get(name, '')))
+        return self.render_members(render_value)
+
+
+def compile_workbook(data, cells):
+    """Компилирует xlsx-шаблон для заполнения ячеек cells активного листа"""
+    members = read_members(data)
+    by_name = {member.name: index for index, member in enumerate(members)}
+    files = _unpack(data, ('xl/workbook.xml', 'xl/_rels/workbook.xml.rels'))
+
+    sheet_name, _ = _active_sheet(files['xl/workbook.xml'], files['xl/_rels/workbook.xml.rels'])
+    sheet_index = by_name[sheet_name]
+    sheet_xml = _unpack(data, (sheet_name,))[sheet_name].decode('utf-8')
+
+    spans = []
+    styles = {}
+    for ref in cells:
+        match = re.search(rf'<c r="{ref}"(?=[\s/>])[^>]*?(?:/>|>.*?</c>)', sheet_xml, re.S)
+        if match is None:
+            raise ValueError(f'Cell {ref} is missing in {sheet_name}')
+        styles[ref] = _cell_style(match.group(0))
+        spans.append((match.start(), match.end(), ref))
+
+    # Ячейки с формулами тоже становятся слотами: в них записываются вычисленные значения
+    formulas = {}
+    for match in FORMULA_CELL_RE.finditer(sheet_xml):
+        ref = match.group(1)
+        if ref in styles:
+            continue
+        styles[ref] = _cell_style(match.group(0))
+        formulas[ref] = match.group(2)
+        spans.append((match.start(), match.end(), ref))
+    spans.sort()
+
+    chunks, keys, pos = [], [], 0
+    for start, end, ref in spans:
+        chunks.append(sheet_xml[pos:start])
+        keys.append(ref)
+        pos = end
+    chunks.append(sheet_xml[pos:])
+
+    members[sheet_index] = None
+    parts = {sheet_index: (sheet_name, chunks, keys)}
+
+    # Значения формул записываются при заполнении, но точность и функции Excel
+    # могут отличаться, поэтому просим Excel пересчитать книгу при открытии
+    workbook_xml = files['xl/workbook.xml'].decode('utf-8')
+    if 'fullCalcOnLoad' not in workbook_xml:
+        workbook_xml = workbook_xml.replace('<calcPr ', '<calcPr fullCalcOnLoad="1" ', 1)
+        members[by_name['xl/workbook.xml']] = ZipMember.from_bytes(
+            'xl/workbook.xml', workbook_xml.encode('utf-8'))
+
+    return WorkbookPlan(members, parts, styles, formulas)
+
+
+def read_active_sheet(data):
+    """Формулы, значения ячеек и именованные диапазоны активного листа книги.
+
+    Возвращает словарь с ключами title (имя листа), formulas
+    ({адрес: '=формула'}), values ({адрес: число, строка или bool})
+    и names ({имя: ссылка}) — аргументы sheet_formulas.SheetFormulas.
+    """
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        present = set(archive.namelist())
+    wanted = ['xl/workbook.xml', 'xl/_rels/workbook.xml.rels']
+    if 'xl/sharedStrings.xml' in present:
+        wanted.append('xl/sharedStrings.xml')
+    files = _unpack(data, wanted)
+    sheet_name, title = _active_sheet(files['xl/workbook.xml'], files['xl/_rels/workbook.xml.rels'])
+    sheet = etree.fromstring(_unpack(data, (sheet_name,))[sheet_name])
+
+    shared_strings = []
+    if 'xl/sharedStrings.xml' in files:
+        for item in etree.fromstring(files['xl/sharedStrings.xml']).iter(f'{{{SHEET_NS}}}si'):
+            shared_strings.append(''.join(item.itertext()))
+
+    formulas, values, shared_formulas = {}, {}, {}
+    for cell in sheet.iter(f'{{{SHEET_NS}}}c'):
+        ref = cell.get('r')
+        formula = cell.find(f'{{{SHEET_NS}}}f')
+        if formula is not None:
+            text = formula.text
+            if formula.get('t') == 'shared':
+                if text:
+                    shared_formulas[formula.get('si')] = (f'={text}', ref)
+                else:
+                    # Общая формула хранится только в первой ячейке диапазона
+                    master, origin = shared_formulas[formula.get('si')]
+                    text = Translator(master, origin=origin).translate_formula(ref)[1:]
+            if text:
+                formulas[ref] = f'={text}'
+            continue
+        value = _cell_value(cell, shared_strings)
+        if value is not None:
+            values[ref] = value
+
+    names = {}
+    for name in etree.fromstring(files['xl/workbook.xml']).iter(f'{{{SHEET_NS}}}definedName'):
+        if not name.get('name', '').startswith('_xlnm.') and name.text:
+            names[name.get('name')] = name.text
+
+    return {'title': title, 'formulas': formulas, 'values': values, 'names': names}
+
+
+def set_formula_values(data, formula_values):
+    """Записывает вычисленные значения формул активного листа в готовый xlsx.
+
+    Используется для книг, сохраненных openpyxl: он пишет формулы без значений.
+    """
+    members = read_members(data)
+    files = _unpack(data, ('xl/workbook.xml', 'xl/_rels/workbook.xml.rels'))
+    sheet_name, _ = _active_sheet(files['xl/workbook.xml'], files['xl/_rels/workbook.xml.rels'])
+    sheet_xml = _unpack(data, (sheet_name,))[sheet_name].decode('utf-8')
+
+    def render(match):
+        ref = match.group(1)
+        if ref not in formula_values:
+            return match.group(0)
+        return _formula_cell_xml(ref, _cell_style(match.group(0)), match.group(2), formula_values[ref])
+
+    sheet_xml = FORMULA_CELL_RE.sub(render, sheet_xml)
+    return build_zip([
+        ZipMember.from_bytes(sheet_name, sheet_xml.encode('utf-8')) if member.name == sheet_name else member
+        for member in members
+    ])
+
+
+def compile_document(data, names):
+    """Компилирует docx-шаблон для подстановки плейсхолдеров с именами names"""
+    names = set(names)
+    members = read_members(data)
+    stories = [m.name for m in members if WORD_STORY_RE.fullmatch(m.name)]
+    files = _unpack(data, stories)
+
+    parts = {}
+    for index, member in enumerate(members):
+        if member.name not in files:
+            continue
+        root = etree.fromstring(files[member.name])
+        found = replace_placeholders(
+            root.iter(W_P), lambda name: f'{_SLOT_OPEN}{name}{_SLOT_CLOSE}' if name in names else None)
+        if not found:
+            continue
+        xml = etree.tostring(root, xml_declaration=True, encoding='UTF-8',
+                             standalone=True).decode('utf-8')
+        pieces = _SLOT_RE.split(xml)
+        parts[index] = (member.name, pieces[0::2], pieces[1::2])
+        members[index] = None
+
+    return DocumentPlan(members, parts)
+
+
+def _cell_xml(ref, style, value):
+    style_attr = f' s="{style}"' if style is not None else ''
+    if value is None or value == '':
+        return f'<c r="{ref}"{style_attr}/>'
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            # В <v> допустимы только конечные числа; nan сделал бы книгу нечитаемой
+            raise ValueError(f'Cell {ref}: non-finite value {value!r}')
+        # 16 значащих цифр, как пишет openpyxl: документы движков совпадают
+        return f'<c r="{ref}"{style_attr}><v>{value:.16g}</v></c>'
+    if isinstance(value, int):
+        return f'<c r="{ref}"{style_attr}><v>{value!r}</v></c>'
+    # Строки записываем как inline string, чтобы не переписывать sharedStrings.xml
+    return (f'<c r="{ref}"{style_attr} t="inlineStr"><is>'
+            f'<t xml:space="preserve">{_text_xml(str(value))}</t></is></c>')
+
+
+def _formula_cell_xml(ref, style, formula, value):
+    style_attr = f' s="{style}"' if style is not None else ''
+    if value is None:
+        return f'<c r="{ref}"{style_attr}>{formula}</c>'
+    if isinstance(value, CellError):
+        return f'<c r="{ref}"{style_attr} t="e">{formula}<v>{escape(value.code)}</v></c>'
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style_attr} t="b">{formula}<v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and not math.isfinite(value):
+            return f'<c r="{ref}"{style_attr} t="e">{formula}<v>#NUM!</v></c>'
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return f'<c r="{ref}"{style_attr}>{formula}<v>{value!r}</v></c>'
+    return f'<c r="{ref}"{style_attr} t="str">{formula}<v>{_text_xml(str(value))}</v></c>'
+
+
+def _cell_style(cell_xml):
+    style = re.search(r'\ss="(\d+)"', cell_xml[:cell_xml.index('>')])
+    return style.group(1) if style else None
+
+
+def _cell_value(cell, shared_strings):
+    kind = cell.get('t', 'n')
+    if kind == 'inlineStr':
+        inline = cell.find(f'{{{SHEET_NS}}}is')
+        return ''.join(inline.itertext()) if inline is not None else None
+    value = cell.find(f'{{{SHEET_NS}}}v')
+    if value is None or value.text is None:
+        return None
+    if kind == 's':
+        return shared_strings[int(value.text)]
+    if kind == 'b':
+        return value.text == '1'
+    if kind == 'e':
+        return CellError(value.text)
+    if kind in ('str', 'd'):
+        return value.text
+    number = float(value.text)
+    return int(number) if number.is_integer() else number
+
+
+def _text_xml(value):
+    # escape() пропускает управляющие символы, а с ними XML не читается;
+    # openpyxl отказывается записывать такую строку, здесь так же
+    if ILLEGAL_CHARACTERS_RE.search(value):
+        raise IllegalCharacterError(f'{value!r} cannot be used in worksheets.')
+    return escape(value)
+
+
+def _run_text_xml(value):
+    # Управляющие символы lxml (и движок python-docx) не принимает
+    if ILLEGAL_CHARACTERS_RE.search(value):
+        raise ValueError(f'Control characters are not allowed in XML text: {value!r}')
+    # Перевод строки внутри w:t не отображается, поэтому закрываем текст и ставим w:br
+    return escape(value).replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+
+
+def _active_sheet(workbook_xml, rels_xml):
+    """Путь к XML активного листа внутри архива и имя листа"""
+    workbook = etree.fromstring(workbook_xml)
+    view = workbook.find(f'{{{SHEET_NS}}}bookViews/{{{SHEET_NS}}}workbookView')
+    active = int(view.get('activeTab', 0)) if view is not None else 0
+    sheets = workbook.findall(f'{{{SHEET_NS}}}sheets/{{{SHEET_NS}}}sheet')
+    rel_id = sheets[active].get(f'{{{DOC_REL_NS}}}id')
+    title = sheets[active].get('name')
+
+    for rel in etree.fromstring(rels_xml).iter(f'{{{REL_NS}}}Relationship'):
+        if rel.get('Id') == rel_id:
+            target = rel.get('Target')
+            if target.startswith('/'):
+                return target[1:], title
+            return posixpath.normpath(posixpath.join('xl', target)), title
+    raise ValueError(f'Relationship {rel_id} not found in workbook.xml.rels')
+
+
+def _unpack(data, names):
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        return {name: archive.read(name) for name in names}
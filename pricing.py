@@ -0,0 +1,60 @@
+import numpy as np
+
+# Константы из бюджета
+PRICING_CONSTANTS = {
+    'conversion_rate': 12,  # Курс юаня к рублю
+    'logistics_cnr_ratio': 0.3,  # Доля логистики КНР
+    'logistics_rf_ratio': 0.7,  # Доля логистики РФ
+    'conversion_fee_rate': 0.032,  # Комиссия за конвертацию 3.2%
+    'credit_rate': 0.16,  # Ставка кредита 16%
+}
+
+
+def price_items(quantities, purchase_costs, weights, logistics_rub, duty_percent,
+                deal_length_days=170, margin_percent=30, **constants):
+    """Рассчитывает продажную цену за единицу для всех позиций КП одним векторным расчетом.
+
+    quantities, purchase_costs, weights и duty_percent задаются по позициям
+    (duty_percent может быть одним числом на все позиции). Общая логистика
+    logistics_rub делится между позициями пропорционально их доле в общем весе.
+    Константы бюджета можно переопределить именованными аргументами, см. PRICING_CONSTANTS.
+    Возвращает numpy-массив цен; для одной позиции результат совпадает
+    с calculate_selling_price до последнего бита.
+    """
+    rates = {**PRICING_CONSTANTS, **constants}
+    quantity = np.asarray(quantities, dtype=float)
+    purchase_cost = np.asarray(purchase_costs, dtype=float)
+    weight = np.asarray(weights, dtype=float)
+    duty = np.asarray(duty_percent, dtype=float)
+
+    # Расчет общего веса всех позиций
+    total_weight = (weight * quantity).sum()
+
+    # Перевод логистики в юани и распределение по весу
+    logistics_total_yuan = logistics_rub / rates['conversion_rate']
+
+    # Расчет логистики на единицу товара (пропорционально весу)
+    logistics_cnr_per_unit = (logistics_total_yuan * rates['logistics_cnr_ratio'] * weight) / total_weight
+    logistics_rf_per_unit = (logistics_total_yuan * rates['logistics_rf_ratio'] * weight) / total_weight
+
+    # Расчет пошлины на единицу товара
+    duty_per_unit = (purchase_cost + logistics_cnr_per_unit) * (duty / 100)
+
+    # Расчет стоимости конвертации (порядок операций как в бюджете, чтобы цены совпадали)
+    conversion_fee_per_unit = purchase_cost * quantity * rates['conversion_fee_rate'] / quantity
+
+    # Расчет кредитных затрат
+    credit_cost_per_unit = purchase_cost * quantity * rates['credit_rate'] / 365 * deal_length_days / quantity
+
+    # Общие затраты на единицу товара
+    total_cost_per_unit = (
+        purchase_cost +
+        logistics_cnr_per_unit +
+        logistics_rf_per_unit +
+        duty_per_unit +
+        conversion_fee_per_unit +
+        credit_cost_per_unit
+    )
+
+    # Расчет цены для маржи margin_percent%
+    return total_cost_per_unit / (1 - margin_percent / 100)
@@ -0,0 +1,517 @@
+import math
+import multiprocessing
+import os
+import re
+from datetime import datetime
+from io import BytesIO
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from template_registry import TemplateRegistry
+from metrics import timed, untimed
+from ooxml_fill import compile_workbook, compile_document, read_active_sheet, set_formula_values
+from pricing import price_items
+from sheet_formulas import CellError, SheetFormulas
+from sheet_rows import insert_item_rows, shift_reference
+from word_fill import index_placeholders, fill_document, expand_item_rows
+from zipstream import build_zip
+
+# Подготовка и рендеринг КП без зависимости от Flask: модуль используется
+# обработчиками app.py, пакетной генерацией и процессами-исполнителями
+
+# Шаблоны документов
+EXCEL_TEMPLATE_PATH = os.path.join('templates_docs', 'template.xlsx')
+WORD_TEMPLATE_PATH = os.path.join('templates_docs', 'template.docx')
+
+# Движок заполнения: 'ooxml' правит XML внутри архива шаблона,
+# 'openpyxl' загружает и сохраняет документы через openpyxl/python-docx
+RENDER_ENGINE = os.environ.get('KP_RENDER_ENGINE', 'ooxml')
+
+# Строка первой позиции на листе Excel; остальные позиции вставляются под ней
+EXCEL_ITEM_ROW = 10
+
+# Маржинальный доход, доля (формула листа); должен совпадать с целевой маржой расчета
+EXCEL_MARGIN_CELL = 'I40'
+
+# Целевая маржа, %
+MARGIN_PERCENT = 30
+
+# Столбцы строки позиции на листе Excel
+EXCEL_ITEM_COLUMNS = ('C', 'D', 'E', 'G', 'H', 'M', 'P', 'X')
+
+# Ячейки активного листа Excel, которые заполняются для каждого КП
+EXCEL_CELLS = ('D2', 'D4', 'D5', 'P4', 'U14', 'I15', 'I16') + tuple(
+    f'{column}{EXCEL_ITEM_ROW}' for column in EXCEL_ITEM_COLUMNS)
+
+# Наибольшее число позиций в одном КП: формулы листа компилируются
+# для каждого числа позиций, время и память растут с ним линейно
+MAX_ITEMS = int(os.environ.get('KP_MAX_ITEMS', 100))
+
+# Поля одной позиции КП; в форме повторяются для каждой позиции
+ITEM_FIELDS = ('product', 'drawing_number', 'material', 'quantity', 'cost_price',
+               'weight', 'duty_percent')
+
+# Плейсхолдеры шаблона Word вида {{ name }}
+WORD_FIELDS = ('company', 'product', 'quantity', 'cost_price', 'weight', 'logistics',
+               'final_price', 'tender_number', 'drawing_number', 'material',
+               'delivery_address', 'date', 'duty_percent', 'deal_length_days',
+               'supply_days', 'payment_days')
+
+# Плейсхолдеры строки позиции в таблице Word: строка повторяется для каждой позиции
+WORD_ITEM_FIELDS = ('product', 'drawing_number', 'material', 'quantity', 'cost_price',
+                    'weight', 'final_price', 'duty_percent')
+
+# Форматы документов КП; /generate может вернуть любой из них или оба в ZIP-архиве
+FORMATS = ('xlsx', 'docx')
+
+MIMETYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'zip': 'application/zip',
+}
+
+templates = TemplateRegistry()
+
+class QuoteDataError(ValueError):
+    """Ошибка в данных КП, текст которой можно показать пользователю"""
+
+def compile_excel_plan(data):
+    return compile_workbook(data, EXCEL_CELLS)
+
+def compile_excel_formulas(data):
+    return SheetFormulas(**read_active_sheet(data))
+
+def compile_word_plan(data):
+    return compile_document(data, WORD_FIELDS)
+
+def index_word_template(data):
+    from docx import Document
+    
+    return index_placeholders(Document(BytesIO(data)))
+
+def render_excel(values, items=()):
+    """Заполняет шаблон Excel и возвращает байты xlsx.
+    
+    values — значения общих ячеек, items — значения строк позиций по столбцам.
+    Время загрузки шаблона, заполнения и сохранения попадает в метрики этапов.
+    """
+    with timed('formulas'):
+        formula_values = evaluate_excel(values, items).formula_values()
+    
+    if RENDER_ENGINE == 'ooxml' and len(items) <= 1:
+        cells = dict(values)
+        for column, value in (items[0] if items else {}).items():
+            cells[f'{column}{EXCEL_ITEM_ROW}'] = value
+        with timed('template_load'):
+            plan = templates.plan(EXCEL_TEMPLATE_PATH, compile_excel_plan)
+        with timed('excel_fill'):
+            members = plan.fill_members(cells, formula_values)
+        with timed('excel_save'):
+            return build_zip(members)
+    
+    # Несколько позиций требуют вставки строк, это делает openpyxl
+    with timed('template_load'):
+        wb = templates.workbook(EXCEL_TEMPLATE_PATH)
+    with timed('excel_fill'):
+        ws = wb.active
+        # Общие ячейки заполняем до вставки: ячейки ниже позиций сдвигаются вместе со строками
+        for ref, value in values.items():
+            ws[ref] = value
+        insert_item_rows(ws, EXCEL_ITEM_ROW, len(items) - 1, wb.defined_names)
+        for number, item in enumerate(items, start=1):
+            row = EXCEL_ITEM_ROW + number - 1
+            ws[f'B{row}'] = number
+            for column, value in item.items():
+                ws[f'{column}{row}'] = value
+    
+    with timed('excel_save'):
+        excel_file = BytesIO()
+        wb.save(excel_file)
+        # openpyxl сохраняет формулы без значений
+        return set_formula_values(excel_file.getvalue(), formula_values)
+
+def evaluate_excel(values, items=()):
+    """Вычисляет формулы листа Excel для значений, которые render_excel запишет в шаблон.
+    
+    Формулы шаблона компилируются один раз; для каждого КП пересчитываются
+    только формулы, зависящие от заполненных ячеек. Возвращает SheetEvaluator
+    с адресами листа после вставки строк позиций.
+    """
+    sheet = templates.plan(EXCEL_TEMPLATE_PATH, compile_excel_formulas)
+    extra_rows = max(len(items) - 1, 0)
+    sheet = sheet.with_item_rows(EXCEL_ITEM_ROW, extra_rows)
+    # Общие ячейки ниже позиций сдвигаются вместе со вставленными строками
+    cells = {shift_reference(ref, EXCEL_ITEM_ROW, extra_rows): value for ref, value in values.items()}
+    for number, item in enumerate(items):
+        for column, value in item.items():
+            cells[f'{column}{EXCEL_ITEM_ROW + number}'] = value
+    return sheet.evaluator(cells)
+
+def check_budget_formulas():
+    """Сверяет расчет цен с формулами листа Excel на контрольном КП.
+    
+    Цены из price_items, подставленные в лист, должны давать целевую маржу
+    в EXCEL_MARGIN_CELL; иначе ValueError с описанием расхождения.
+    """
+    form_data = {'company': 'Контроль', 'logistics': '150000', 'deal_length_days': '170',
+                 'duty_percent': '5'}
+    items = [
+        {'product': 'Вал', 'quantity': '3', 'cost_price': '35000', 'weight': '200'},
+        {'product': 'Ось', 'quantity': '2', 'cost_price': '1000', 'weight': '10', 'duty_percent': '0'},
+    ]
+    for count in (1, len(items)):
+        quote = build_quote(form_data, items[:count])
+        evaluator = evaluate_excel(quote['excel_values'], quote['excel_items'])
+        margin = evaluator[shift_reference(EXCEL_MARGIN_CELL, EXCEL_ITEM_ROW, count - 1)]
+        if isinstance(margin, CellError) or not isinstance(margin, (int, float)) \
+                or abs(margin - MARGIN_PERCENT / 100) > 1e-9:
+            raise ValueError(f'Budget formulas disagree with pricing: margin {margin!r} '
+                             f'instead of {MARGIN_PERCENT / 100} for {count} item(s)')
+
+def render_word(values, items=()):
+    """Подставляет значения в плейсхолдеры шаблона Word и возвращает байты docx.
+    
+    Для нескольких позиций строка таблицы с плейсхолдерами позиции
+    повторяется для каждого элемента items.
+    """
+    if len(items) <= 1:
+        values = {**values, **(items[0] if items else {})}
+        items = ()
+    
+    if RENDER_ENGINE == 'ooxml' and not items:
+        with timed('template_load'):
+            plan = templates.plan(WORD_TEMPLATE_PATH, compile_word_plan)
+        with timed('word_fill'):
+            members = plan.fill_members(values)
+        with timed('word_save'):
+            return build_zip(members)
+    
+    with timed('template_load'):
+        doc = templates.document(WORD_TEMPLATE_PATH)
+        index = templates.plan(WORD_TEMPLATE_PATH, index_word_template)
+    with timed('word_fill'):
+        fill_document(doc, values, index)
+        if items:
+            expand_item_rows(doc, WORD_ITEM_FIELDS, items)
+    
+    with timed('word_save'):
+        word_file = BytesIO()
+        doc.save(word_file)
+        return word_file.getvalue()
+
+def warm_templates(multi_item=True):
+    """Разбирает шаблоны заранее, чтобы первый запрос не платил за загрузку.
+    
+    КП с несколькими позициями и в движке ooxml заполняются через
+    openpyxl/python-docx; multi_item=False пропускает эти снимки там,
+    где бывают только КП с одной позицией (пакетная генерация).
+    Возвращает список пар (путь, исключение) для шаблонов, которые не удалось загрузить.
+    """
+    loaders = ()
+    if RENDER_ENGINE == 'ooxml':
+        loaders += ((EXCEL_TEMPLATE_PATH, lambda path: templates.plan(path, compile_excel_plan)),
+                    (WORD_TEMPLATE_PATH, lambda path: templates.plan(path, compile_word_plan)))
+    if RENDER_ENGINE != 'ooxml' or multi_item:
+        loaders += ((EXCEL_TEMPLATE_PATH, templates.workbook),
+                    (WORD_TEMPLATE_PATH, templates.document),
+                    (WORD_TEMPLATE_PATH, lambda path: templates.plan(path, index_word_template)))
+    # Формулы листа компилируются заранее и сразу сверяются с расчетом цен
+    loaders += ((EXCEL_TEMPLATE_PATH, lambda path: check_budget_formulas()),)
+    failures = []
+    with untimed():
+        for path, load in loaders:
+            try:
+                load(path)
+            except Exception as e:
+                failures.append((path, e))
+    return failures
+
+def process_context():
+    """Способ запуска процессов для пулов генерации.
+    
+    Пулы создаются в многопоточном процессе сервера; после fork блокировка,
+    которую держал другой поток (метрики, кэш шаблонов), навсегда осталась бы
+    занятой в дочернем процессе. Процессы пула запускаются через forkserver
+    (или spawn, где его нет) и сами прогревают шаблоны в initializer.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+def validate_form_data(form_data):
+    """Проверяет корректность данных формы"""
+    # Проверка обязательных полей
+    required_fields = ['company', 'product', 'quantity', 'cost_price', 'weight', 'logistics']
+    
+    # Проверка числовых значений
+    numeric_fields = ['quantity', 'cost_price', 'weight', 'logistics', 'duty_percent', 'deal_length_days']
+    
+    return _validate_fields(form_data, required_fields, numeric_fields)
+
+def validate_items(items):
+    """Проверяет позиции КП, начиная со второй (первая проверяется вместе с формой)"""
+    errors = []
+    if len(items) > MAX_ITEMS:
+        errors.append(f'В одном КП не больше {MAX_ITEMS} позиций.')
+    for number, item in enumerate(items[1:], start=2):
+        item_errors = _validate_fields(item, ['product', 'quantity', 'cost_price', 'weight'],
+                                       ['quantity', 'cost_price', 'weight', 'duty_percent'])
+        errors.extend(f'Позиция {number}: {error}' for error in item_errors)
+    return errors
+
+def validate_quote(form_data, items=None):
+    """Проверки, которым нужен расчет по уже проверенным полям: общий вес,
+    длина сделки, переполнение цен. Возвращает список ошибок.
+    """
+    try:
+        with untimed():
+            price_quote(form_data, items)
+    except QuoteDataError as e:
+        return [str(e)]
+    return []
+
+def _validate_fields(form_data, required_fields, numeric_fields):
+    errors = []
+    
+    # Управляющие символы (например, \v из Word при вставке) в документы не записать
+    for field, value in form_data.items():
+        if isinstance(value, str) and ILLEGAL_CHARACTERS_RE.search(value):
+            errors.append(f'Поле "{field}" содержит недопустимые управляющие символы.')
+    
+    for field in required_fields:
+        if not form_data.get(field) or not form_data[field].strip():
+            errors.append(f'Поле "{field}" является обязательным.')
+    
+    for field in numeric_fields:
+        if form_data.get(field) and form_data[field].strip():
+            try:
+                value = float(form_data[field])
+                if not math.isfinite(value):
+                    # nan и inf float() принимает, но для КП это не числа
+                    raise ValueError(value)
+                if value < 0:
+                    errors.append(f'Поле "{field}" должно быть неотрицательным числом.')
+                if field == 'duty_percent' and value > 100:
+                    errors.append(f'Поле "{field}" не может превышать 100%.')
+                if field == 'quantity' and value == 0:
+                    errors.append(f'Поле "{field}" не может быть нулевым.')
+                if field == 'quantity' and not _is_integer(form_data[field]):
+                    errors.append(f'Поле "{field}" должно быть целым числом.')
+                if field == 'deal_length_days' and value < 30:
+                    errors.append(f'Поле "{field}" не может быть меньше 30 дней.')
+            except ValueError:
+                errors.append(f'Поле "{field}" должно быть числом.')
+    
+    return errors
+
+def _is_integer(text):
+    # Количество разбирается через int(), как в _parse_quote
+    try:
+        int(text)
+    except ValueError:
+        return False
+    return True
+
+def items_from_form(form):
+    """Собирает позиции КП из повторяющихся полей формы (MultiDict с getlist)"""
+    columns = {field: form.getlist(field) for field in ITEM_FIELDS}
+    count = max(len(values) for values in columns.values())
+    items = []
+    for index in range(count):
+        item = {field: values[index] if index < len(values) else ''
+                for field, values in columns.items()}
+        # Пустые строки позиций (например, добавленные и не заполненные) пропускаем
+        if index == 0 or any(item[field].strip() for field in ('product', 'quantity', 'cost_price', 'weight')):
+            items.append(item)
+    return items
+
+def parse_formats(values):
+    """Разбирает выбор форматов документов: 'xlsx', 'docx', 'both' или список через запятую.
+    
+    Возвращает форматы в порядке FORMATS; без выбора — оба формата.
+    """
+    selected = set()
+    for value in values:
+        for name in value.replace(',', ' ').split():
+            name = name.lower()
+            if name == 'both':
+                selected.update(FORMATS)
+            elif name in FORMATS:
+                selected.add(name)
+            else:
+                raise QuoteDataError(f'Неизвестный формат "{name}": xlsx, docx или both.')
+    return tuple(name for name in FORMATS if name in selected) or FORMATS
+
+def get_safe_filename(company_name):
+    """Создает безопасное имя файла из названия компании"""
+    safe_name = re.sub(r'[^\w\s-]', '', company_name).strip()
+    safe_name = re.sub(r'[-\s]+', '_', safe_name)
+    return safe_name[:50]
+
+def calculate_selling_price(quantity, purchase_cost, logistics_rub, duty_percent, weight, deal_length_days=170, margin_percent=30):
+    """Выполняет расчет продажной цены с учетом всех параметров бюджета"""
+    # Расчет для одной позиции; формулы бюджета в pricing.price_items
+    prices = price_items([quantity], [purchase_cost], [weight], logistics_rub, duty_percent,
+                         deal_length_days, margin_percent)
+    return float(prices[0])
+
+def _parse_quote(form_data, items=None):
+    """Числа и строки позиций из проверенных данных формы (см. build_quote)"""
+    duty_percent = float(form_data.get('duty_percent') or 0)
+    deal_length_days = float(form_data.get('deal_length_days') or 170)
+    
+    # Расчет сроков поставки и оплаты
+    supply_days = deal_length_days - 30
+    payment_days = 30
+    
+    if supply_days < 0:
+        raise QuoteDataError('Общая длина сделки не может быть меньше 30 дней.')
+    
+    if not items:
+        items = [form_data]
+    quantities = [int(item['quantity']) for item in items]
+    weights = [float(item['weight']) for item in items]
+    # Логистика делится по весу: при нулевом общем весе цены не определены
+    if not sum(weight * quantity for weight, quantity in zip(weights, quantities)) > 0:
+        raise QuoteDataError('Общий вес позиций должен быть больше нуля.')
+    return {
+        'logistics': float(form_data['logistics']),
+        'deal_length_days': deal_length_days,
+        'supply_days': supply_days,
+        'payment_days': payment_days,
+        'products': [item['product'].strip() for item in items],
+        'drawing_numbers': [item.get('drawing_number', '').strip() for item in items],
+        'materials': [item.get('material', '').strip() for item in items],
+        'quantities': quantities,
+        'cost_prices': [float(item['cost_price']) for item in items],
+        'weights': weights,
+        'duties': [float(item.get('duty_percent') or duty_percent) for item in items],
+    }
+
+def _price_parsed(parsed):
+    # Выполнение расчетов с учетом всех параметров бюджета, сразу для всех позиций
+    with timed('pricing'):
+        prices = price_items(
+            parsed['quantities'], parsed['cost_prices'], parsed['weights'],
+            logistics_rub=parsed['logistics'],
+            duty_percent=parsed['duties'],
+            deal_length_days=parsed['deal_length_days'],
+            margin_percent=MARGIN_PERCENT
+        ).tolist()
+    # Переполнение на огромных числах: ни в JSON, ни в документ такая цена не попадет
+    if not all(math.isfinite(price) for price in prices):
+        raise QuoteDataError('Цена слишком велика для расчета, проверьте числа КП.')
+    return prices
+
+def price_quote(form_data, items=None):
+    """Только расчет цен по проверенным данным формы, без шаблонов и документов.
+    
+    Возвращает цену за единицу по позициям и общую сумму КП.
+    """
+    parsed = _parse_quote(form_data, items)
+    final_prices = _price_parsed(parsed)
+    total = sum(price * quantity for price, quantity in zip(final_prices, parsed['quantities']))
+    if not math.isfinite(total):
+        raise QuoteDataError('Сумма КП слишком велика для расчета.')
+    return {
+        'final_price': final_prices[0],
+        'final_prices': final_prices,
+        'total': total,
+        'deal_length_days': parsed['deal_length_days'],
+        'supply_days': parsed['supply_days'],
+        'payment_days': parsed['payment_days'],
+    }
+
+def build_quote(form_data, items=None):
+    """Преобразует проверенные данные формы в значения для шаблонов Excel и Word.
+    
+    items — позиции КП (словари с полями ITEM_FIELDS); по умолчанию одна позиция
+    из полей самой формы. Пустая пошлина позиции берется из формы.
+    """
+    # Извлечение и преобразование данных
+    company = form_data['company'].strip()
+    
+    # Новые поля
+    tender_number = form_data.get('tender_number', '').strip()
+    delivery_address = form_data.get('delivery_address', '').strip()
+    
+    parsed = _parse_quote(form_data, items)
+    logistics = parsed['logistics']
+    deal_length_days = parsed['deal_length_days']
+    supply_days = parsed['supply_days']
+    payment_days = parsed['payment_days']
+    final_prices = _price_parsed(parsed)
+    
+    current_date = datetime.now().strftime('%d.%m.%Yг.')
+    
+    excel_values = {
+        # Основные данные
+        'D4': company,
+        'U14': logistics,
+        'I15': supply_days,  # Срок поставки
+        'I16': payment_days,  # Срок оплаты
+        
+        # Дополнительные поля
+        'D2': current_date,  # Дата формирования
+        'D5': tender_number,  # Номер тендера
+        'P4': delivery_address,  # Адрес доставки
+    }
+    
+    word_values = {
+        'company': company,
+        'logistics': f"{logistics:.2f}",
+        'tender_number': tender_number,
+        'delivery_address': delivery_address,
+        'date': current_date,
+        'deal_length_days': str(deal_length_days),
+        'supply_days': str(supply_days),
+        'payment_days': str(payment_days),
+    }
+    
+    excel_items = []
+    word_items = []
+    for product, drawing_number, material, quantity, cost_price, weight, duty, final_price in zip(
+            parsed['products'], parsed['drawing_numbers'], parsed['materials'], parsed['quantities'],
+            parsed['cost_prices'], parsed['weights'], parsed['duties'], final_prices):
+        # Формируем текст для ячейки C строки позиции
+        product_with_drawing = product
+        if drawing_number:
+            product_with_drawing += f" ч.{drawing_number}"
+        
+        excel_items.append({
+            'C': product_with_drawing,  # Наименование товара с номером чертежа
+            'D': material,  # Материал
+            'E': drawing_number,  # Номер чертежа
+            'G': quantity,
+            'H': final_price,  # Финальная цена
+            'M': cost_price,
+            'P': weight,
+            'X': duty / 100,  # Процент пошлины (доля)
+        })
+        word_items.append({
+            'product': product,
+            'drawing_number': drawing_number,
+            'material': material,
+            'quantity': str(quantity),
+            'cost_price': f"{cost_price:.2f}",
+            'weight': f"{weight:.2f}",
+            'final_price': f"{final_price:.2f}",
+            'duty_percent': f"{duty:.1f}",
+        })
+    
+    return {
+        'company': company,
+        'final_price': final_prices[0],
+        'final_prices': final_prices,
+        'file_prefix': f"КП_{get_safe_filename(company)}_{datetime.now().strftime('%Y%m%d_%H%M')}",
+        'excel_values': excel_values,
+        'excel_items': excel_items,
+        'word_values': word_values,
+        'word_items': word_items,
+    }
+
+def render_quote(form_data, items=None):
+    """Готовит КП по данным формы и возвращает (префикс имени файла, xlsx, docx)"""
+    quote = build_quote(form_data, items)
+    return (quote['file_prefix'],
+            render_excel(quote['excel_values'], quote['excel_items']),
+            render_word(quote['word_values'], quote['word_items']))
@@ -0,0 +1,321 @@
+import json
+import math
+import os
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from pricing import PRICING_CONSTANTS, price_items
+from zipstream import ZipMember, iter_zip
+
+# Сетка сценариев: как меняется цена КП при переборе маржи, пошлины, длины
+# сделки, курса юаня и ставки кредита. Вся сетка считается одним векторным
+# расчетом numpy (оси параметров складываются через broadcasting), а вывод
+# форматируется блоками, без объектов Python на каждую точку сетки.
+
+# Параметры сетки в порядке осей результата и их значения по умолчанию
+SCENARIO_PARAMETERS = {
+    'margin_percent': 30,
+    'duty_percent': 0,
+    'deal_length_days': 170,
+    'conversion_rate': PRICING_CONSTANTS['conversion_rate'],
+    'credit_rate': PRICING_CONSTANTS['credit_rate'],
+}
+
+# Допустимые значения параметров: за их пределами цена бесконечна или
+# не имеет смысла (деление на 1 - маржа и на курс)
+SCENARIO_RANGES = {
+    'margin_percent': (lambda values: values < 100, 'маржа должна быть меньше 100%'),
+    'duty_percent': (lambda values: (values >= 0) & (values <= 100), 'пошлина от 0 до 100%'),
+    'deal_length_days': (lambda values: values >= 0, 'длина сделки не может быть отрицательной'),
+    'conversion_rate': (lambda values: values > 0, 'курс должен быть больше нуля'),
+    'credit_rate': (lambda values: values >= 0, 'ставка не может быть отрицательной'),
+}
+
+# Предел числа точек сетки (с учетом числа позиций) на один запрос
+SCENARIO_MAX_POINTS = int(os.environ.get('KP_SCENARIO_MAX_POINTS', 2_000_000))
+
+SHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+# Ограничения листа Excel
+XLSX_MAX_ROWS = 1_048_576
+XLSX_MAX_COLUMNS = 16_384
+
+# Сколько значений форматируется за один раз при выводе
+CHUNK_POINTS = 65_536
+
+# Сколько чисел держать в памяти на промежуточных массивах расчета
+EVAL_BUDGET = 1 << 20
+
+
+class ScenarioError(ValueError):
+    """Некорректный запрос сетки сценариев"""
+
+
+class ScenarioGrid:
+    """Результат расчета сетки: оси параметров и массив цен формы shape"""
+
+    def __init__(self, axes, fixed, values, metric):
+        self.axes = axes  # [(имя параметра, numpy-массив значений)]
+        self.fixed = fixed  # {имя параметра: значение} для параметров без диапазона
+        self.values = values  # numpy-массив, по оси на каждый параметр из axes
+        self.metric = metric  # 'unit_price' для одной позиции, 'total' для нескольких
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def size(self):
+        return self.values.size
+
+    def iter_json(self):
+        """JSON с осями и плоским списком значений (порядок C, последняя ось меняется быстрее)"""
+        head = {
+            'metric': self.metric,
+            'axes': [{'name': name, 'values': values.tolist()} for name, values in self.axes],
+            'fixed': self.fixed,
+            'shape': list(self.shape),
+        }
+        yield json.dumps(head, ensure_ascii=False)[:-1].encode('utf-8')
+        yield b', "values": ['
+        first = True
+        for text in _iter_formatted(self.values.ravel(), ', '):
+            yield (text if first else ', ' + text).encode('ascii')
+            first = False
+        yield b']}'
+
+    def iter_csv(self):
+        """CSV-матрица: строки — сочетания всех осей кроме последней, столбцы — последняя ось"""
+        # BOM, чтобы Excel открыл файл в UTF-8
+        yield ('\ufeff' + ';'.join(self._header()) + '\r\n').encode('utf-8')
+        for text in self._iter_rows('', ';', '\r\n'):
+            yield text.encode('ascii')
+
+    def to_xlsx(self):
+        """Та же матрица, что в CSV, на листе книги Excel"""
+        header = self._header()
+        rows = self.size // (len(header) - len(self._row_axes())) + 1
+        if rows > XLSX_MAX_ROWS or len(header) > XLSX_MAX_COLUMNS:
+            raise ScenarioError('Сетка не помещается на лист Excel, выберите формат csv или json.')
+
+        parts = [
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<worksheet xmlns="{SHEET_NS}"><sheetData><row>',
+            ''.join(f'<c t="inlineStr"><is><t>{escape(text)}</t></is></c>' for text in header),
+            '</row>',
+        ]
+        parts.extend(self._iter_rows('<row><c><v>', '</v></c><c><v>', '</v></c></row>'))
+        parts.append('</sheetData></worksheet>')
+
+        members = [ZipMember.from_bytes(name, content.encode('utf-8'))
+                   for name, content in _XLSX_STATIC_PARTS]
+        members.append(ZipMember.from_bytes('xl/worksheets/sheet1.xml', ''.join(parts).encode('utf-8')))
+        return b''.join(iter_zip(members))
+
+    def _row_axes(self):
+        # Одна ось (или ни одной) выводится столбцом, иначе последняя ось идет по столбцам
+        return self.axes if len(self.axes) < 2 else self.axes[:-1]
+
+    def _header(self):
+        names = [name for name, _ in self.axes]
+        if len(self.axes) < 2:
+            return names + [self.metric]
+        last_name, last_values = self.axes[-1]
+        return names[:-1] + [f'{last_name}=%g' % value for value in last_values.tolist()]
+
+    def _iter_rows(self, prefix, separator, suffix):
+        """Строки матрицы блоками: подписи осей строки, затем значения строки"""
+        row_axes = self._row_axes()
+        row_shape = [len(values) for _, values in row_axes]
+        columns = self.size // int(np.prod(row_shape)) if row_axes else self.size
+        matrix = self.values.reshape(-1, columns)
+        line = prefix + separator.join(['%g'] * len(row_axes) + ['%.2f'] * columns) + suffix
+        block_rows = max(1, CHUNK_POINTS // (columns + len(row_axes)))
+        for start in range(0, matrix.shape[0], block_rows):
+            stop = min(start + block_rows, matrix.shape[0])
+            # Подписи строк берутся из осей по индексам блока, а не хранятся для всей сетки
+            index = np.unravel_index(np.arange(start, stop), row_shape) if row_axes else ()
+            labels = [values[i] for (_, values), i in zip(row_axes, index)]
+            block = np.column_stack(labels + [matrix[start:stop]])
+            yield (line * (stop - start)) % tuple(block.ravel().tolist())
+
+
+def parse_axis(name, spec, max_points=SCENARIO_MAX_POINTS):
+    """Значения параметра: число, список чисел или диапазон {start, stop, step|num}.
+
+    Диапазон длиннее max_points отклоняется до того, как создан массив значений.
+    """
+    try:
+        if isinstance(spec, dict):
+            start, stop = float(spec['start']), float(spec['stop'])
+            if 'num' in spec:
+                num = int(spec['num'])
+                if num < 1:
+                    raise ScenarioError(f'Параметр "{name}": num должен быть не меньше 1.')
+                _check_count(name, num, max_points)
+                return _check_range(name, np.linspace(start, stop, num))
+            step = float(spec['step'])
+            if step <= 0 or stop < start:
+                raise ScenarioError(f'Параметр "{name}": нужен step > 0 и stop >= start.')
+            count = int(np.floor((stop - start) / step + 1e-9)) + 1
+            _check_count(name, count, max_points)
+            return _check_range(name, start + step * np.arange(count))
+        values = np.atleast_1d(np.asarray(spec, dtype=float))
+    except ScenarioError:
+        raise
+    except (KeyError, TypeError, ValueError, OverflowError):
+        raise ScenarioError(f'Параметр "{name}": ожидается число, список или диапазон start/stop/step.')
+    if values.ndim != 1 or values.size == 0:
+        raise ScenarioError(f'Параметр "{name}": ожидается непустой список чисел.')
+    _check_count(name, values.size, max_points)
+    return _check_range(name, values)
+
+
+def _check_count(name, count, max_points):
+    if count > max_points:
+        raise ScenarioError(f'Параметр "{name}": слишком много значений, сетка больше предела '
+                            f'{SCENARIO_MAX_POINTS} точек.')
+
+
+def _check_range(name, values):
+    if not np.isfinite(values).all():
+        raise ScenarioError(f'Параметр "{name}": ожидаются конечные числа.')
+    allowed, message = SCENARIO_RANGES[name]
+    if not allowed(values).all():
+        raise ScenarioError(f'Параметр "{name}": {message}.')
+    return values
+
+
+def build_grid(request_data):
+    """Считает сетку сценариев по JSON-запросу.
+
+    request_data содержит данные позиции как в форме (quantity, cost_price,
+    weight, logistics, duty_percent, deal_length_days) или список items, и
+    словарь parameters с диапазонами параметров из SCENARIO_PARAMETERS.
+    Пошлина из сетки (или из запроса) одна для всех позиций. Для одной
+    позиции значение сетки — цена за единицу, для нескольких — сумма КП
+    (цена × количество по всем позициям).
+    """
+    if not isinstance(request_data, dict):
+        raise ScenarioError('Ожидается JSON-объект.')
+    parameters = request_data.get('parameters') or {}
+    if not isinstance(parameters, dict):
+        raise ScenarioError('Поле "parameters" должно быть объектом.')
+    unknown = sorted(set(parameters) - set(SCENARIO_PARAMETERS))
+    if unknown:
+        raise ScenarioError(f'Неизвестные параметры: {", ".join(unknown)}.')
+
+    items = request_data.get('items') or [request_data]
+    try:
+        quantities = np.array([float(item['quantity']) for item in items])
+        costs = np.array([float(item['cost_price']) for item in items])
+        weights = np.array([float(item['weight']) for item in items])
+        logistics = float(request_data['logistics'])
+    except (KeyError, TypeError, ValueError):
+        raise ScenarioError('Для каждой позиции нужны числа quantity, cost_price, weight и общая logistics.')
+    if not (np.isfinite(quantities).all() and np.isfinite(costs).all() and np.isfinite(weights).all()
+            and np.isfinite(logistics)):
+        raise ScenarioError('Количество, цены, вес и логистика должны быть конечными числами.')
+    if (quantities <= 0).any() or (costs < 0).any() or (weights < 0).any() or logistics < 0:
+        raise ScenarioError('Количество должно быть положительным, цены и вес — неотрицательными.')
+    if not (weights * quantities).sum() > 0:
+        raise ScenarioError('Общий вес позиций должен быть больше нуля.')
+
+    defaults = dict(SCENARIO_PARAMETERS)
+    for name in ('duty_percent', 'deal_length_days'):
+        if request_data.get(name) not in (None, ''):
+            defaults[name] = request_data[name]
+
+    # Каждая ось проверяется по пределу, оставшемуся после предыдущих осей,
+    # до создания ее значений
+    axes, fixed = [], {}
+    remaining = SCENARIO_MAX_POINTS // len(items)
+    for name, default in defaults.items():
+        if name in parameters:
+            values = parse_axis(name, parameters[name], remaining)
+            axes.append((name, values))
+            remaining //= len(values)
+        else:
+            fixed[name] = float(parse_axis(name, default)[0])
+
+    # Размер в целых Python: np.prod в int64 переполнился бы незаметно
+    size = math.prod(len(values) for _, values in axes)
+    if size * len(items) > SCENARIO_MAX_POINTS:
+        raise ScenarioError(f'Сетка из {size} точек для {len(items)} позиций больше предела '
+                            f'{SCENARIO_MAX_POINTS}.')
+
+    values = _evaluate(axes, fixed, quantities, costs, weights, logistics)
+    return ScenarioGrid(axes, fixed, values, 'unit_price' if len(items) == 1 else 'total')
+
+
+def _evaluate(axes, fixed, quantities, costs, weights, logistics):
+    shape = [len(values) for _, values in axes]
+    result = np.empty(shape, dtype=float)
+    if not axes:
+        prices = price_items(quantities, costs, weights, logistics, **fixed)
+        result[()] = prices[0] if len(quantities) == 1 else (prices * quantities).sum()
+        return result
+
+    # Сетку считаем слоями по первой оси, чтобы промежуточные массивы
+    # (точки × позиции) не превышали EVAL_BUDGET чисел
+    layer = max(1, result[0].size * len(quantities))
+    step = max(1, EVAL_BUDGET // layer)
+    ndim = len(axes) + 1  # последняя ось — позиции
+    for start in range(0, shape[0], step):
+        grid = {}
+        for axis, (name, values) in enumerate(axes):
+            if axis == 0:
+                values = values[start:start + step]
+            grid[name] = values.reshape([-1 if i == axis else 1 for i in range(ndim)])
+        arguments = {**fixed, **grid}
+        prices = price_items(quantities, costs, weights, logistics, **arguments)
+        if len(quantities) == 1:
+            result[start:start + step] = prices[..., 0]
+        else:
+            result[start:start + step] = (prices * quantities).sum(axis=-1)
+    return result
+
+
+def _iter_formatted(values, separator):
+    """Значения с двумя знаками после запятой, блоками по CHUNK_POINTS"""
+    for start in range(0, values.size, CHUNK_POINTS):
+        chunk = values[start:start + CHUNK_POINTS]
+        yield separator.join(['%.2f'] * chunk.size) % tuple(chunk.tolist())
+
+
+# Минимальный набор частей книги xlsx с одним листом
+_XLSX_STATIC_PARTS = (
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" '
+     'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+     'Target="xl/workbook.xml"/></Relationships>'),
+    ('xl/workbook.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     f'<workbook xmlns="{SHEET_NS}" '
+     'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+     '<sheets><sheet name="Сценарии" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" '
+     'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+     'Target="worksheets/sheet1.xml"/></Relationships>'),
+)
+
+
+def scenario_filename(extension):
+    return f"Сценарии_{datetime.now().strftime('%Y%m%d_%H%M')}.{extension}"
@@ -0,0 +1,117 @@
+"""Продакшн-запуск генератора КП: несколько рабочих процессов gunicorn.
+
+Запуск из корня проекта (Linux/macOS): python server.py
+Приложение импортируется и шаблоны разбираются один раз в главном процессе
+до того, как сервер откроет порт (preload_app). Рабочие процессы получают
+готовые шаблоны через fork и отвечают на первый же запрос без холодного
+старта. Файл лога пишет главный процесс за всех.
+
+Переменные окружения:
+    KP_BIND          адрес и порт (0.0.0.0:5000)
+    KP_JOBS          0 — выключить фоновую генерацию /jobs (по умолчанию включена)
+    KP_WORKERS       число рабочих процессов (с /jobs только 1; без них — число ядер, не больше 4)
+    KP_THREADS       потоков в процессе (хватает на генерации, их очередь и легкие запросы)
+    KP_TIMEOUT       секунд без ответа до перезапуска процесса (120)
+    KP_MAX_REQUESTS  запросов до плановой замены процесса (без /jobs — 1000, с /jobs только 0 — без замены)
+    KP_ACCESS_LOG    файл журнала запросов или "-" для stderr (по умолчанию выключен)
+Ограничение одновременных генераций (KP_MAX_RENDERS, KP_RENDER_QUEUE,
+KP_RENDER_WAIT) действует в каждом рабочем процессе отдельно.
+
+Состояние хранится в памяти каждого рабочего процесса:
+- задания /jobs — поэтому с /jobs сервер запускается с одним процессом и без
+  плановой замены; перезапуск сервера (HUP, деплой) задания все равно теряет;
+- /metrics, /api/admission/stats, /api/jobs/stats и /api/templates/stats
+  показывают только процесс, ответивший на запрос (его pid есть в
+  /api/admission/stats). Счетчики обнуляются при замене процесса. Общую
+  картину дает сумма по процессам; при KP_WORKERS=1 это один процесс.
+"""
+import gc
+import multiprocessing
+import os
+import sys
+import time
+
+from gunicorn.app.base import BaseApplication
+
+
+def options_from_env(environ=os.environ):
+    # Все места генерации и очередь к ним обслуживаются потоками процесса:
+    # при меньшем числе потоков лишние запросы ждали бы в очереди gunicorn
+    # вместо быстрого 503
+    threads = int(environ.get('KP_THREADS', 0)) or (
+        int(environ.get('KP_MAX_RENDERS', 2)) + int(environ.get('KP_RENDER_QUEUE', 4)) + 2)
+    # Задание /jobs живет в процессе, который его принял: запрос статуса
+    # в другой процесс получил бы 404
+    jobs = environ.get('KP_JOBS', '1') != '0'
+    workers = int(environ.get('KP_WORKERS', 0)) or (1 if jobs else min(os.cpu_count() or 1, 4))
+    if jobs and workers > 1:
+        raise ValueError(f'KP_WORKERS={workers} requires KP_JOBS=0: /jobs state is kept '
+                         f'in a single worker process')
+    # Плановая замена единственного процесса потеряла бы задания в очереди,
+    # в работе и готовые результаты: с /jobs процесс не заменяется
+    max_requests = int(environ.get('KP_MAX_REQUESTS', 0 if jobs else 1000))
+    if jobs and max_requests:
+        raise ValueError(f'KP_MAX_REQUESTS={max_requests} requires KP_JOBS=0: recycling the '
+                         f'worker would drop /jobs state')
+    return {
+        'bind': environ.get('KP_BIND', '0.0.0.0:5000'),
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': threads,
+        'timeout': int(environ.get('KP_TIMEOUT', 120)),
+        'graceful_timeout': 30,
+        'max_requests': max_requests,
+        'max_requests_jitter': 100,
+        'preload_app': True,
+        'accesslog': environ.get('KP_ACCESS_LOG'),
+        'when_ready': when_ready,
+        'post_fork': post_fork,
+    }
+
+
+class KPServer(BaseApplication):
+    """gunicorn с настройками из options_from_env и приложением app:app"""
+
+    def __init__(self, options):
+        self.options = options
+        self.log_records = None
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # С preload_app вызывается в главном процессе до открытия порта
+        started = time.perf_counter()
+        import app
+
+        self.log_records = multiprocessing.Queue()
+        app.start_log_writer(self.log_records)
+        app.app.logger.info(f'KP Generator loaded in {time.perf_counter() - started:.2f} s')
+        return app.app
+
+
+def when_ready(server):
+    # Объекты, созданные при загрузке, сборщик мусора больше не обходит:
+    # страницы памяти с шаблонами остаются общими у рабочих процессов
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Поток записи лога остался в главном процессе, записи идут к нему через очередь
+    import app
+
+    app.use_log_queue(server.app.log_records)
+
+
+def main():
+    try:
+        options = options_from_env()
+    except ValueError as e:
+        sys.exit(f'server.py: {e}')
+    KPServer(options).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import json
+import os
+
+# Настройки приложения из config/settings.json; отсутствующие ключи
+# берутся из DEFAULT_SETTINGS.
+
+SETTINGS_PATH = os.path.join('config', 'settings.json')
+
+DEFAULT_SETTINGS = {
+    'max_history_items': 50,
+    'max_history_bytes': 256 * 1024 * 1024,
+}
+
+
+def load_settings(path=SETTINGS_PATH):
+    """Читает настройки; если файла нет, возвращает значения по умолчанию"""
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(path, encoding='utf-8') as f:
+            settings.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    return settings
@@ -0,0 +1,595 @@
+import math
+import threading
+
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.utils.cell import get_column_letter, range_boundaries
+
+from sheet_rows import CELL_RE, insert_cell_rows, shift_reference
+
+# Вычисление формул листа Excel в Python.
+# Формулы листа разбираются один раз и компилируются в функции Python,
+# упорядоченные по зависимостям. Вычислитель хранит значения всех ячеек и
+# при изменении входных ячеек пересчитывает только зависящие от них формулы.
+# Поддерживается подмножество Excel, которое используют шаблоны бюджета:
+# арифметика, сравнения, &, %, ссылки, диапазоны, имена и функции из FUNCTIONS.
+
+# Больше ячеек в одном диапазоне не разворачиваем (A:A и подобные не поддерживаются)
+MAX_RANGE_CELLS = 10000
+
+# Сколько наборов измененных ячеек и вариантов листа со вставленными строками хранить
+CACHE_SIZE = 64
+
+# Сколько формул всего хранить в вариантах листа со вставленными строками:
+# вариант на сотни позиций занимает мегабайты, один такой вытесняет старые
+EXPANDED_CACHE_FORMULAS = 20000
+
+
+class FormulaError(ValueError):
+    """Формула использует возможности Excel, которые здесь не поддерживаются"""
+
+
+class CellError(Exception):
+    """Значение-ошибка Excel (#DIV/0!, #VALUE! ...).
+
+    Хранится в ячейке как значение; при чтении такой ячейки формулой
+    возбуждается и становится значением этой формулы.
+    """
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+    def __eq__(self, other):
+        return isinstance(other, CellError) and other.code == self.code
+
+    def __hash__(self):
+        return hash(self.code)
+
+    def __repr__(self):
+        return f'CellError({self.code!r})'
+
+
+class SheetFormulas:
+    """Скомпилированные формулы одного листа.
+
+    formulas — {адрес: '=формула'}, values — значения остальных ячеек листа,
+    names — именованные диапазоны {имя: 'Лист!$A$1'}, title — имя листа.
+    Формулы, которые не удалось разобрать, циклические ссылки и все
+    зависящие от них формулы не вычисляются и перечислены в unsupported.
+    """
+
+    def __init__(self, formulas, values=None, names=None, title=None):
+        self.formulas = dict(formulas)
+        self.constants = dict(values or {})
+        self.names = dict(names or {})
+        self.title = title
+        self.unsupported = {}
+
+        functions, dependencies = self._compile()
+        self.order = self._sort(dependencies)
+        self._functions = functions
+        self._steps = tuple((ref, functions[ref]) for ref in self.order)
+        self._dependents = {}
+        for ref in self.order:
+            for dependency in dependencies[ref]:
+                self._dependents.setdefault(dependency, set()).add(ref)
+        self._position = {ref: index for index, ref in enumerate(self.order)}
+
+        self._lock = threading.Lock()
+        self._affected = {}
+        self._expanded = {}
+        # Значения листа как в шаблоне: от них считаются все заполнения
+        self.base = dict(self.constants)
+        self._run(self.base, self._steps)
+
+    def evaluator(self, values=None):
+        """Новый вычислитель с значениями шаблона и, если заданы, входными values"""
+        evaluator = SheetEvaluator(self)
+        if values:
+            evaluator.set(values)
+        return evaluator
+
+    def evaluate(self, values=None):
+        """Значения всех ячеек листа после подстановки values и полного пересчета"""
+        cells = dict(self.constants)
+        cells.update(values or {})
+        self._run(cells, self._steps)
+        return cells
+
+    def affected(self, changed):
+        """Формулы, которые зависят от ячеек changed, в порядке вычисления"""
+        key = frozenset(changed)
+        steps = self._affected.get(key)
+        if steps is not None:
+            return steps
+
+        found = set()
+        pending = list(key)
+        while pending:
+            for ref in self._dependents.get(pending.pop(), ()):
+                if ref not in found:
+                    found.add(ref)
+                    pending.append(ref)
+        steps = tuple((ref, self._functions[ref])
+                      for ref in sorted(found, key=self._position.__getitem__))
+        with self._lock:
+            if len(self._affected) >= CACHE_SIZE:
+                self._affected.clear()
+            self._affected[key] = steps
+        return steps
+
+    def with_item_rows(self, item_row, count):
+        """Лист, где под строкой item_row вставлено count ее копий (см. sheet_rows.insert_item_rows).
+
+        Варианты компилируются один раз для каждого count и хранятся в кэше
+        не больше CACHE_SIZE штук и EXPANDED_CACHE_FORMULAS формул; первыми
+        вытесняются самые старые.
+        """
+        if count <= 0:
+            return self
+        key = (item_row, count)
+        sheet = self._expanded.get(key)
+        if sheet is not None:
+            return sheet
+
+        sheet = SheetFormulas(
+            insert_cell_rows(self.formulas, item_row, count),
+            insert_cell_rows(self.constants, item_row, count),
+            {name: shift_reference(ref, item_row, count) if self._on_sheet(ref) else ref
+             for name, ref in self.names.items()},
+            self.title,
+        )
+        with self._lock:
+            self._expanded[key] = sheet
+            total = sum(len(expanded.formulas) for expanded in self._expanded.values())
+            while len(self._expanded) > 1 and (len(self._expanded) > CACHE_SIZE
+                                               or total > EXPANDED_CACHE_FORMULAS):
+                oldest = next(iter(self._expanded))
+                total -= len(self._expanded.pop(oldest).formulas)
+        return sheet
+
+    def _compile(self):
+        functions, dependencies, sources = {}, {}, []
+        for index, (ref, formula) in enumerate(self.formulas.items()):
+            try:
+                expression, refs = _FormulaParser(formula, self._resolve).parse()
+            except FormulaError as e:
+                self.unsupported[ref] = str(e)
+                continue
+            dependencies[ref] = refs
+            sources.append((ref, f'f{index}', expression))
+
+        # Все формулы листа компилируются одним модулем: по функции на ячейку
+        code = '\n'.join(f'def {name}(v):\n    return _result({expression})'
+                         for ref, name, expression in sources)
+        namespace = dict(_RUNTIME)
+        exec(compile(code, f'<formulas {self.title}>', 'exec'), namespace)
+        for ref, name, expression in sources:
+            functions[ref] = namespace[name]
+        return functions, dependencies
+
+    def _sort(self, dependencies):
+        """Топологический порядок формул; циклические ссылки не вычисляются"""
+        while True:
+            # Формулы, зависящие от неподдерживаемых, тоже не вычисляются
+            changed = True
+            while changed:
+                changed = False
+                for ref, refs in list(dependencies.items()):
+                    broken = next((dependency for dependency in refs if dependency in self.unsupported), None)
+                    if broken is not None:
+                        self.unsupported[ref] = f'depends on {broken}'
+                        del dependencies[ref]
+                        changed = True
+
+            cycle = None
+            order, state = [], {}
+            for start in dependencies:
+                if start in state or cycle:
+                    continue
+                # Обход в глубину без рекурсии: (ячейка, итератор по ее зависимостям)
+                stack = [(start, iter(dependencies[start]))]
+                state[start] = 'visiting'
+                while stack and not cycle:
+                    ref, pending = stack[-1]
+                    for dependency in pending:
+                        if dependency not in dependencies:
+                            continue
+                        if state.get(dependency) == 'visiting':
+                            refs = [item for item, _ in stack]
+                            cycle = refs[refs.index(dependency):]
+                            break
+                        if dependency not in state:
+                            state[dependency] = 'visiting'
+                            stack.append((dependency, iter(dependencies[dependency])))
+                            break
+                    else:
+                        stack.pop()
+                        state[ref] = 'done'
+                        order.append(ref)
+            if not cycle:
+                return tuple(order)
+            for ref in cycle:
+                self.unsupported[ref] = 'circular reference: ' + ' -> '.join(cycle)
+                del dependencies[ref]
+
+    def _on_sheet(self, reference):
+        sheet, sep, _ = reference.rpartition('!')
+        return not sep or sheet.strip("'") == self.title
+
+    def _resolve(self, reference):
+        """Ссылка из формулы -> адрес ячейки или кортеж адресов диапазона, без '$'"""
+        name = self.names.get(reference)
+        if name is not None:
+            reference = name
+        if not self._on_sheet(reference):
+            raise FormulaError(f'Reference to another sheet: {reference}')
+        address = reference.rpartition('!')[2].replace('$', '')
+        if CELL_RE.match(address):
+            return address.upper()
+        if ':' not in address:
+            raise FormulaError(f'Unknown name: {reference}')
+        try:
+            min_col, min_row, max_col, max_row = range_boundaries(address)
+        except ValueError:
+            raise FormulaError(f'Unsupported reference: {reference}')
+        if None in (min_col, min_row, max_col, max_row):
+            raise FormulaError(f'Whole rows or columns are not supported: {reference}')
+        if (max_col - min_col + 1) * (max_row - min_row + 1) > MAX_RANGE_CELLS:
+            raise FormulaError(f'Range is too large: {reference}')
+        return tuple(f'{get_column_letter(column)}{row}'
+                     for row in range(min_row, max_row + 1)
+                     for column in range(min_col, max_col + 1))
+
+    @staticmethod
+    def _run(cells, steps):
+        for ref, function in steps:
+            try:
+                cells[ref] = function(cells)
+            except CellError as e:
+                cells[ref] = e
+
+
+class SheetEvaluator:
+    """Значения ячеек листа для одного заполнения; пересчитывает только затронутые формулы"""
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.values = dict(sheet.base)
+
+    def set(self, values):
+        """Записывает значения входных ячеек и пересчитывает зависящие от них формулы.
+
+        Возвращает адреса пересчитанных формул.
+        """
+        changed = []
+        for ref, value in values.items():
+            if ref in self.sheet.formulas:
+                raise ValueError(f'Cell {ref} contains a formula')
+            if value == '':
+                value = None
+            if self.values.get(ref) != value or type(self.values.get(ref)) is not type(value):
+                self.values[ref] = value
+                changed.append(ref)
+        if not changed:
+            return ()
+        steps = self.sheet.affected(changed)
+        self.sheet._run(self.values, steps)
+        return tuple(ref for ref, _ in steps)
+
+    def __getitem__(self, ref):
+        return self.values.get(ref)
+
+    def formula_values(self):
+        """Вычисленные значения всех поддерживаемых формул листа"""
+        return {ref: self.values[ref] for ref in self.sheet.order}
+
+
+class _FormulaParser:
+    """Разбор формулы Excel в выражение Python по токенам openpyxl.
+
+    Ячейки читаются из словаря v; пустая ячейка — None.
+    """
+
+    # Приоритеты бинарных операторов Excel (больше — связывает сильнее)
+    PRECEDENCE = {'=': 1, '<>': 1, '<': 1, '>': 1, '<=': 1, '>=': 1,
+                  '&': 2, '+': 3, '-': 3, '*': 4, '/': 4, '^': 5}
+
+    def __init__(self, formula, resolve):
+        if not isinstance(formula, str) or not formula.startswith('='):
+            raise FormulaError(f'Not a formula: {formula!r}')
+        self.formula = formula
+        self.resolve = resolve
+        try:
+            items = Tokenizer(formula).items
+        except Exception as e:
+            raise FormulaError(f'Cannot tokenize {formula}: {e}')
+        self.tokens = [token for token in items if token.type != Token.WSPACE]
+        self.position = 0
+        self.refs = set()
+
+    def parse(self):
+        expression = self._expression(0)
+        if self.position != len(self.tokens):
+            raise FormulaError(f'Unexpected {self.tokens[self.position].value!r} in {self.formula}')
+        return expression, frozenset(self.refs)
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise FormulaError(f'Unexpected end of {self.formula}')
+        self.position += 1
+        return token
+
+    def _expression(self, min_precedence):
+        left = self._unary()
+        while True:
+            token = self._peek()
+            if token is None or token.type != Token.OP_IN:
+                return left
+            precedence = self.PRECEDENCE.get(token.value)
+            if precedence is None:
+                raise FormulaError(f'Unsupported operator {token.value!r} in {self.formula}')
+            if precedence < min_precedence:
+                return left
+            self._next()
+            right = self._expression(precedence + 1)
+            left = _binary(token.value, left, right)
+
+    def _unary(self):
+        token = self._peek()
+        if token is not None and token.type == Token.OP_PRE:
+            self._next()
+            operand = self._unary()
+            return f'(-_num({operand}))' if token.value == '-' else operand
+        operand = self._primary()
+        while True:
+            token = self._peek()
+            if token is None or token.type != Token.OP_POST:
+                return operand
+            self._next()
+            operand = f'(_num({operand}) / 100)'
+
+    def _primary(self):
+        token = self._next()
+        if token.type == Token.OPERAND:
+            return self._operand(token)
+        if token.type == Token.PAREN and token.subtype == Token.OPEN:
+            expression = self._expression(0)
+            closing = self._next()
+            if closing.type != Token.PAREN:
+                raise FormulaError(f'Expected ")" in {self.formula}')
+            return f'({expression})'
+        if token.type == Token.FUNC and token.subtype == Token.OPEN:
+            return self._function(token.value[:-1].upper())
+        raise FormulaError(f'Unexpected {token.value!r} in {self.formula}')
+
+    def _operand(self, token):
+        if token.subtype == Token.NUMBER:
+            return repr(float(token.value))
+        if token.subtype == Token.TEXT:
+            return repr(token.value[1:-1].replace('""', '"'))
+        if token.subtype == Token.LOGICAL:
+            return 'True' if token.value.upper() == 'TRUE' else 'False'
+        if token.subtype == Token.ERROR:
+            return f'_error({token.value!r})'
+        target = self.resolve(token.value)
+        if isinstance(target, tuple):
+            self.refs.update(target)
+            return '(' + ''.join(f'v.get({ref!r}), ' for ref in target) + ')'
+        self.refs.add(target)
+        return f'v.get({target!r})'
+
+    def _function(self, name):
+        args = []
+        token = self._peek()
+        if token is not None and token.type == Token.FUNC and token.subtype == Token.CLOSE:
+            self._next()
+        else:
+            while True:
+                token = self._peek()
+                if token is not None and (token.type == Token.SEP or
+                                          (token.type == Token.FUNC and token.subtype == Token.CLOSE)):
+                    args.append('None')  # пропущенный аргумент
+                else:
+                    args.append(self._expression(0))
+                token = self._next()
+                if token.type == Token.FUNC and token.subtype == Token.CLOSE:
+                    break
+                if token.type != Token.SEP:
+                    raise FormulaError(f'Expected "," in {self.formula}')
+
+        if name == 'IF':
+            # Невыбранная ветвь IF не вычисляется, как в Excel
+            if not 2 <= len(args) <= 3:
+                raise FormulaError(f'IF expects 2 or 3 arguments in {self.formula}')
+            otherwise = args[2] if len(args) == 3 else 'False'
+            return f'({args[1]} if _truth({args[0]}) else {otherwise})'
+        if name not in FUNCTIONS:
+            raise FormulaError(f'Unsupported function {name} in {self.formula}')
+        return f'_{name.lower()}({", ".join(args)})'
+
+
+def _binary(operator, left, right):
+    if operator in ('+', '-', '*'):
+        return f'(_num({left}) {operator} _num({right}))'
+    if operator == '/':
+        return f'_div({left}, {right})'
+    if operator == '^':
+        return f'_pow({left}, {right})'
+    if operator == '&':
+        return f'(_text({left}) + _text({right}))'
+    comparison = '!=' if operator == '<>' else '==' if operator == '=' else operator
+    return f'(_compare({left}, {right}) {comparison} 0)'
+
+
+# Функции времени выполнения, доступные скомпилированным формулам
+
+def _num(value):
+    if type(value) in (int, float):
+        return value
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, CellError):
+        raise value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    raise CellError('#VALUE!')
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, CellError):
+        raise value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, tuple):
+        raise CellError('#VALUE!')
+    return str(value)
+
+
+def _truth(value):
+    if value is None:
+        return False
+    if isinstance(value, str):
+        if value.upper() in ('TRUE', 'FALSE'):
+            return value.upper() == 'TRUE'
+        raise CellError('#VALUE!')
+    return bool(_num(value))
+
+
+def _compare(left, right):
+    """Сравнение по правилам Excel: числа < текст < логические, текст без учета регистра"""
+    left, right = _comparable(left, right), _comparable(right, left)
+    if left[0] != right[0]:
+        return -1 if left[0] < right[0] else 1
+    return (left[1] > right[1]) - (left[1] < right[1])
+
+
+def _comparable(value, other):
+    if isinstance(value, CellError):
+        raise value
+    if isinstance(other, CellError):
+        raise other
+    if value is None:
+        # Пустая ячейка равна 0, "" или ЛОЖЬ в зависимости от второго операнда
+        value = '' if isinstance(other, str) else False if isinstance(other, bool) else 0
+    if isinstance(value, bool):
+        return (2, value)
+    if isinstance(value, str):
+        return (1, value.casefold())
+    if isinstance(value, tuple):
+        raise CellError('#VALUE!')
+    return (0, value)
+
+
+def _div(left, right):
+    right = _num(right)
+    if right == 0:
+        raise CellError('#DIV/0!')
+    return _num(left) / right
+
+
+def _pow(left, right):
+    try:
+        result = _num(left) ** _num(right)
+    except (ZeroDivisionError, OverflowError):
+        raise CellError('#NUM!')
+    if isinstance(result, complex):
+        raise CellError('#NUM!')
+    return result
+
+
+def _error(code):
+    raise CellError(code)
+
+
+def _result(value):
+    if value is None:
+        return 0
+    if isinstance(value, tuple):
+        raise CellError('#VALUE!')
+    return value
+
+
+def _numbers(args):
+    """Числа аргументов функции: в диапазонах текст и пустые ячейки пропускаются"""
+    for arg in args:
+        if isinstance(arg, tuple):
+            for value in arg:
+                if isinstance(value, CellError):
+                    raise value
+                if type(value) in (int, float):
+                    yield value
+        elif arg is not None:
+            yield _num(arg)
+
+
+def _sum(*args):
+    return sum(_numbers(args))
+
+
+def _average(*args):
+    values = list(_numbers(args))
+    if not values:
+        raise CellError('#DIV/0!')
+    return sum(values) / len(values)
+
+
+def _min(*args):
+    return min(_numbers(args), default=0)
+
+
+def _max(*args):
+    return max(_numbers(args), default=0)
+
+
+def _count(*args):
+    return sum(1 for arg in args for value in (arg if isinstance(arg, tuple) else (arg,))
+               if type(value) in (int, float))
+
+
+def _abs(value):
+    return abs(_num(value))
+
+
+def _round(value, digits=0):
+    # Excel округляет половину от нуля, а не к четному
+    value, digits = _num(value), int(_num(digits))
+    factor = 10.0 ** digits
+    return math.copysign(math.floor(abs(value) * factor + 0.5) / factor, value)
+
+
+def _and(*args):
+    return all(_truth(value) for arg in args
+               for value in (arg if isinstance(arg, tuple) else (arg,)) if value is not None)
+
+
+def _or(*args):
+    return any(_truth(value) for arg in args
+               for value in (arg if isinstance(arg, tuple) else (arg,)) if value is not None)
+
+
+def _not(value):
+    return not _truth(value)
+
+
+FUNCTIONS = ('SUM', 'AVERAGE', 'MIN', 'MAX', 'COUNT', 'ABS', 'ROUND', 'AND', 'OR', 'NOT', 'IF')
+
+_RUNTIME = {
+    '_num': _num, '_text': _text, '_truth': _truth, '_compare': _compare, '_div': _div,
+    '_pow': _pow, '_error': _error, '_result': _result, '_sum': _sum, '_average': _average,
+    '_min': _min, '_max': _max, '_count': _count, '_abs': _abs, '_round': _round,
+    '_and': _and, '_or': _or, '_not': _not,
+}
@@ -0,0 +1,175 @@
+import re
+from copy import copy
+
+from openpyxl.formatting.formatting import ConditionalFormattingList
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.worksheet.cell_range import MultiCellRange
+
+# Вставка строк позиций КП в лист openpyxl.
+# openpyxl.insert_rows только сдвигает ячейки, поэтому ссылки в формулах,
+# объединенные ячейки, условное форматирование, проверки данных, высоты
+# строк и именованные диапазоны сдвигаются здесь вручную.
+
+CELL_RE = re.compile(r'^(\$?)([A-Za-z]{1,3})(\$?)(\d+)$')
+
+
+def shift_formula(formula, shift_row):
+    """Пересчитывает номера строк во всех ссылках формулы.
+
+    shift_row(row, absolute, range_end) возвращает новый номер строки.
+    Ссылки на другие листы и имена без адреса ячейки не меняются.
+    """
+    if not isinstance(formula, str) or not formula.startswith('='):
+        return formula
+    tokenizer = Tokenizer(formula)
+    changed = False
+    for token in tokenizer.items:
+        if token.type == Token.OPERAND and token.subtype == Token.RANGE:
+            value = _shift_range(token.value, shift_row)
+            if value != token.value:
+                token.value = value
+                changed = True
+    return tokenizer.render() if changed else formula
+
+
+def insert_item_rows(ws, item_row, count, defined_names=None):
+    """Добавляет count строк-копий строки item_row сразу под ней.
+
+    Формулы строки item_row в копиях ссылаются на свою строку, а ссылки на
+    строки ниже (итоги, логистика) остаются общими. Диапазоны, заканчивающиеся
+    на item_row (например, SUM(I10:I10)), расширяются на новые строки.
+    """
+    if count <= 0:
+        return
+
+    inserted = _inserted_rows(item_row, count)
+    for row in ws.iter_rows():
+        for cell in row:
+            if cell.data_type == 'f':
+                cell.value = shift_formula(cell.value, inserted)
+
+    dimensions = {
+        row: dimension for row, dimension in ws.row_dimensions.items() if row > item_row
+    }
+    ws.insert_rows(item_row + 1, count)
+    for row in sorted(dimensions, reverse=True):
+        _set_row_dimension(ws, row + count, dimensions[row])
+
+    for merged in ws.merged_cells.ranges:
+        if merged.min_row > item_row:
+            merged.shift(row_shift=count)
+
+    _shift_conditional_formatting(ws, inserted)
+    for validation in ws.data_validations.dataValidation:
+        validation.sqref = MultiCellRange(_shift_sqref(validation.sqref, inserted))
+        validation.formula1 = _shift_bare(validation.formula1, inserted)
+        validation.formula2 = _shift_bare(validation.formula2, inserted)
+
+    for name in (defined_names or {}).values():
+        prefix, sep, ref = name.attr_text.rpartition('!')
+        if sep and prefix.strip("'") == ws.title:
+            name.attr_text = f'{prefix}!{_shift_range(ref, inserted)}'
+
+    # Копии строки позиции: стиль, высота и формулы со ссылками на свою строку
+    source = list(ws[item_row])
+    source_dimension = ws.row_dimensions[item_row]
+    for offset in range(1, count + 1):
+        target = item_row + offset
+        own_row = _copied_row(item_row, target)
+        _set_row_dimension(ws, target, source_dimension)
+        for cell in source:
+            new = ws.cell(row=target, column=cell.column)
+            new._style = copy(cell._style)
+            if cell.data_type == 'f':
+                new.value = shift_formula(cell.value, own_row)
+            else:
+                new.value = cell.value
+
+
+def insert_cell_rows(cells, item_row, count):
+    """То же, что insert_item_rows, для словаря {адрес: значение или '=формула'}.
+
+    Возвращает новый словарь: ячейки ниже item_row сдвинуты на count строк,
+    ссылки в формулах пересчитаны, а ячейки строки item_row скопированы в новые строки.
+    """
+    if count <= 0:
+        return dict(cells)
+
+    inserted = _inserted_rows(item_row, count)
+    result = {}
+    source = []
+    for ref, value in cells.items():
+        col_abs, column, row_abs, row = CELL_RE.match(ref).groups()
+        row = int(row)
+        value = shift_formula(value, inserted)
+        if row == item_row:
+            source.append((column, value))
+        result[f'{column}{row + count if row > item_row else row}'] = value
+
+    for offset in range(1, count + 1):
+        target = item_row + offset
+        own_row = _copied_row(item_row, target)
+        for column, value in source:
+            result[f'{column}{target}'] = shift_formula(value, own_row)
+    return result
+
+
+def shift_reference(ref, item_row, count):
+    """Адрес или диапазон (можно с именем листа) после вставки count строк под item_row"""
+    return _shift_range(ref, _inserted_rows(item_row, count))
+
+
+def _inserted_rows(item_row, count):
+    # Строки ниже item_row сдвигаются; диапазоны, заканчивающиеся на item_row, расширяются
+    def inserted(row, absolute, range_end):
+        if row > item_row or (range_end and row == item_row):
+            return row + count
+        return row
+    return inserted
+
+
+def _copied_row(item_row, target):
+    # Относительные ссылки копии строки item_row указывают на саму копию
+    def own_row(row, absolute, range_end):
+        return target if row == item_row and not absolute else row
+    return own_row
+
+
+def _set_row_dimension(ws, row, dimension):
+    moved = copy(dimension)
+    moved.index = row
+    ws.row_dimensions[row] = moved
+
+
+def _shift_range(ref, shift_row):
+    sheet, sep, address = ref.rpartition('!')
+    parts = address.split(':')
+    if len(parts) > 2 or not all(CELL_RE.match(part) for part in parts):
+        return ref
+    shifted = []
+    for index, part in enumerate(parts):
+        col_abs, col, row_abs, row = CELL_RE.match(part).groups()
+        row = shift_row(int(row), bool(row_abs), index == len(parts) - 1 and len(parts) == 2)
+        shifted.append(f'{col_abs}{col}{row_abs}{row}')
+    return f'{sheet}{sep}{":".join(shifted)}'
+
+
+def _shift_sqref(sqref, shift_row):
+    return ' '.join(_shift_range(str(part), shift_row) for part in sqref.ranges)
+
+
+def _shift_bare(formula, shift_row):
+    """Формула без знака '=', как в проверках данных и условном форматировании"""
+    if not formula:
+        return formula
+    return shift_formula('=' + formula, shift_row)[1:]
+
+
+def _shift_conditional_formatting(ws, shift_row):
+    shifted = ConditionalFormattingList()
+    for formatting in ws.conditional_formatting:
+        sqref = _shift_sqref(formatting.sqref, shift_row)
+        for rule in formatting.rules:
+            rule.formula = [_shift_bare(f, shift_row) for f in rule.formula]
+            shifted.add(sqref, rule)
+    ws.conditional_formatting = shifted
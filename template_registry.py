@@ -0,0 +1,128 @@
+import copy
+import hashlib
+import os
+import pickle
+import threading
+from io import BytesIO
+
+
+class TemplateEntry:
+    """Разобранный шаблон и отметка версии файла, из которого он получен"""
+
+    def __init__(self, path, signature, digest, snapshot):
+        self.path = path
+        self.signature = signature  # (mtime_ns, size) на момент разбора
+        self.digest = digest  # sha256 содержимого файла
+        self.snapshot = snapshot
+
+
+class TemplateRegistry:
+    """Кэш шаблонов документов в памяти.
+
+    Каждый шаблон разбирается один раз, а каждый запрос получает собственную
+    дешевую копию. Файл перечитывается только при изменении mtime/размера,
+    а повторный разбор выполняется только если изменилось содержимое.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'reloads': 0}
+
+    def workbook(self, path):
+        """Возвращает независимую копию книги Excel"""
+        # Копия через pickle примерно в 30 раз быстрее повторного load_workbook
+        entry = self._get(path, 'workbook', _snapshot_workbook)
+        return pickle.loads(entry.snapshot)
+
+    def document(self, path):
+        """Возвращает независимую копию документа Word"""
+        entry = self._get(path, 'document', _snapshot_document)
+        return copy.deepcopy(entry.snapshot)
+
+    def plan(self, path, compile_plan):
+        """Возвращает общий для всех запросов план заполнения шаблона.
+
+        compile_plan(data) получает байты файла шаблона; план не должен
+        изменяться при заполнении, поэтому копия не создается. Планы
+        кэшируются по самой функции: разные функции с одинаковым именем
+        (например, две lambda) получают разные планы.
+        """
+        return self._get(path, compile_plan, compile_plan).snapshot
+
+    def version(self, path):
+        """Возвращает хэш текущего содержимого файла шаблона.
+
+        Если файл не менялся с последнего разбора, хэш берется из кэша,
+        иначе файл хэшируется заново (без разбора).
+        """
+        # FileNotFoundError пробрасывается вызывающему коду
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+        for (entry_path, _), entry in list(self._entries.items()):
+            if entry_path == path and entry.signature == signature:
+                return entry.digest
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def stats(self):
+        """Счетчики попаданий/промахов кэша и список загруженных шаблонов"""
+        with self._lock:
+            stats = dict(self._counters)
+        stats['templates'] = {
+            f'{path} ({getattr(kind, "__name__", kind)})': entry.digest[:12]
+            for (path, kind), entry in list(self._entries.items())
+        }
+        return stats
+
+    def _get(self, path, kind, snapshot_from):
+        # FileNotFoundError пробрасывается вызывающему коду
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+
+        key = (path, kind)
+        entry = self._entries.get(key)
+        if entry is not None and entry.signature == signature:
+            with self._lock:
+                self._counters['hits'] += 1
+            return entry
+
+        with self._lock:
+            # Пока ждали блокировку, шаблон мог перезагрузить другой поток
+            entry = self._entries.get(key)
+            if entry is not None and entry.signature == signature:
+                self._counters['hits'] += 1
+                return entry
+
+            with open(path, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+
+            if entry is not None and entry.digest == digest:
+                # Файл "тронули", но содержимое не изменилось
+                entry.signature = signature
+                self._counters['hits'] += 1
+                return entry
+
+            self._counters['misses'] += 1
+            if entry is not None:
+                self._counters['reloads'] += 1
+
+            entry = TemplateEntry(path, signature, digest, snapshot_from(data))
+            self._entries[key] = entry
+            return entry
+
+
+# Снимки нужны многопозиционным КП и движку openpyxl. python-docx импортируется
+# при первом снимке: приложение делает его при прогреве шаблонов (warm_templates),
+# а процессы пакетной генерации с движком ooxml не импортируют вовсе
+def _snapshot_workbook(data):
+    from openpyxl import load_workbook
+
+    return pickle.dumps(load_workbook(BytesIO(data)), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _snapshot_document(data):
+    from docx import Document
+
+    return Document(BytesIO(data))
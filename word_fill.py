@@ -0,0 +1,187 @@
+import re
+from bisect import bisect_right
+from copy import deepcopy
+
+# Подстановка значений в плейсхолдеры {{ name }} документа Word.
+# Работает напрямую с XML абзацев (w:p/w:r/w:t), поэтому находит плейсхолдеры,
+# разбитые Word на несколько run, сохраняет форматирование и обходит все части
+# документа: основной текст, колонтитулы, надписи и вложенные таблицы.
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+W_P = f'{{{W_NS}}}p'
+W_T = f'{{{W_NS}}}t'
+W_BR = f'{{{W_NS}}}br'
+W_TR = f'{{{W_NS}}}tr'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+PLACEHOLDER_RE = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+# Части документа Word, в которых могут стоять плейсхолдеры
+WORD_STORY_RE = re.compile(r'/?word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml')
+
+
+class PlaceholderIndex:
+    """Номера абзацев с плейсхолдерами в каждой части шаблона.
+
+    Строится один раз по шаблону и подходит для любой его копии, так как
+    порядок абзацев в копии совпадает с оригиналом.
+    """
+
+    def __init__(self, paragraphs):
+        self.paragraphs = paragraphs  # {имя части: номера абзацев по порядку обхода}
+
+    def __len__(self):
+        return sum(len(numbers) for numbers in self.paragraphs.values())
+
+
+def story_parts(doc):
+    """XML-части документа python-docx, в которых может быть текст"""
+    for part in doc.part.package.iter_parts():
+        if WORD_STORY_RE.fullmatch(str(part.partname)) and hasattr(part, 'element'):
+            yield part
+
+
+def index_placeholders(doc):
+    """Находит абзацы шаблона, в тексте которых есть плейсхолдеры"""
+    paragraphs = {}
+    for part in story_parts(doc):
+        numbers = [
+            number for number, paragraph in enumerate(part.element.iter(W_P))
+            if PLACEHOLDER_RE.search(''.join(node.text or '' for node in _text_nodes(paragraph)))
+        ]
+        if numbers:
+            paragraphs[str(part.partname)] = numbers
+    return PlaceholderIndex(paragraphs)
+
+
+def fill_document(doc, values, index=None):
+    """Заменяет плейсхолдеры документа значениями values за один проход.
+
+    values — словарь {имя: текст}; плейсхолдеры с неизвестными именами
+    остаются как есть. С index обрабатываются только заранее найденные абзацы.
+    Возвращает количество выполненных замен.
+    """
+    def replacement(name):
+        value = values.get(name)
+        return None if value is None else str(value)
+
+    count = 0
+    for part in story_parts(doc):
+        if index is None:
+            count += replace_placeholders(part.element.iter(W_P), replacement)
+            continue
+        numbers = index.paragraphs.get(str(part.partname))
+        if not numbers:
+            continue
+        wanted = set(numbers)
+        last = numbers[-1]
+        selected = []
+        for number, paragraph in enumerate(part.element.iter(W_P)):
+            if number in wanted:
+                selected.append(paragraph)
+            if number == last:
+                break
+        count += replace_placeholders(selected, replacement)
+    return count
+
+
+def expand_item_rows(doc, names, items):
+    """Повторяет строки таблиц с плейсхолдерами позиций для каждой позиции.
+
+    Строка таблицы, в которой есть хотя бы один плейсхолдер из names,
+    копируется для каждого словаря items и заполняется его значениями;
+    исходная строка удаляется. Возвращает количество размноженных строк.
+    """
+    names = set(names)
+    count = 0
+    for part in story_parts(doc):
+        rows = [
+            row for row in part.element.iter(W_TR)
+            if names.intersection(PLACEHOLDER_RE.findall(
+                ''.join(node.text or '' for node in row.iter(W_T))))
+        ]
+        for row in rows:
+            anchor = row
+            for values in items:
+                clone = deepcopy(row)
+                replace_placeholders(
+                    clone.iter(W_P),
+                    lambda name, values=values: str(values[name]) if name in values else None)
+                anchor.addnext(clone)
+                anchor = clone
+            row.getparent().remove(row)
+            count += 1
+    return count
+
+
+def replace_placeholders(paragraphs, replacement):
+    """Заменяет плейсхолдеры в абзацах, в том числе разбитые по нескольким run.
+
+    Текст подстановки попадает в первый run плейсхолдера и наследует его
+    форматирование, остальные части плейсхолдера удаляются из своих run.
+    replacement(name) возвращает текст замены или None, чтобы оставить плейсхолдер.
+    Возвращает количество выполненных замен.
+    """
+    # Абзацы собираем заранее: вставка w:br меняет дерево во время обхода
+    count = 0
+    for paragraph in list(paragraphs):
+        nodes = list(_text_nodes(paragraph))
+        if not nodes:
+            continue
+        texts = [node.text or '' for node in nodes]
+        full = ''.join(texts)
+        if '{{' not in full:
+            continue
+
+        starts = []
+        offset = 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text)
+
+        changed = set()
+        # С конца абзаца, чтобы смещения еще не обработанных совпадений не сдвигались
+        for match in reversed(list(PLACEHOLDER_RE.finditer(full))):
+            value = replacement(match.group(1))
+            if value is None:
+                continue
+            start, end = match.span()
+            first = bisect_right(starts, start) - 1
+            last = bisect_right(starts, end - 1) - 1
+            for i in range(first, last + 1):
+                text = texts[i]
+                lo = max(start - starts[i], 0)
+                hi = min(end - starts[i], len(text))
+                texts[i] = text[:lo] + (value if i == first else '') + text[hi:]
+                changed.add(i)
+            count += 1
+
+        for i in changed:
+            _set_text(nodes[i], texts[i])
+    return count
+
+
+def _text_nodes(element):
+    """Элементы w:t абзаца по порядку, без вложенных абзацев (надписи)"""
+    for child in element:
+        if child.tag == W_P:
+            continue
+        if child.tag == W_T:
+            yield child
+        else:
+            yield from _text_nodes(child)
+
+
+def _set_text(node, text):
+    node.set(XML_SPACE, 'preserve')
+    lines = text.split('\n')
+    node.text = lines[0]
+    # Перевод строки внутри w:t не отображается, поэтому переносим через w:br
+    anchor = node
+    for line in lines[1:]:
+        br = node.makeelement(W_BR, {})
+        anchor.addnext(br)
+        t = node.makeelement(W_T, {XML_SPACE: 'preserve'})
+        t.text = line
+        br.addnext(t)
+        anchor = t
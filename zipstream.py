@@ -0,0 +1,122 @@
+import os
+import struct
+import time
+import zlib
+import zipfile
+from io import BytesIO
+
+# Сигнатуры записей ZIP (APPNOTE.TXT)
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+
+_UTF8_FLAG = 0x800
+
+# Типы файлов, которые кладутся в архив без сжатия. xlsx и docx — сами ZIP-архивы
+# со сжатыми частями, повторное сжатие почти не уменьшает их и тратит CPU.
+STORED_EXTENSIONS = frozenset(
+    f'.{ext.strip().lower().lstrip(".")}'
+    for ext in os.environ.get('KP_ZIP_STORED_TYPES', 'xlsx,docx,zip').split(',') if ext.strip())
+
+
+def compression_for(name):
+    """Способ сжатия элемента архива по расширению имени файла"""
+    extension = os.path.splitext(name)[1].lower()
+    return zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+class ZipMember:
+    """Элемент архива с уже сжатыми данными.
+
+    Хранит ровно те байты, которые попадут в архив, поэтому элементы
+    исходного шаблона можно переносить в новый архив без распаковки.
+    """
+
+    __slots__ = ('name', 'payload', 'crc', 'size', 'compress_type', 'date_time')
+
+    def __init__(self, name, payload, crc, size, compress_type, date_time):
+        self.name = name
+        self.payload = payload
+        self.crc = crc
+        self.size = size
+        self.compress_type = compress_type
+        self.date_time = date_time
+
+    @classmethod
+    def from_bytes(cls, name, data, compress_type=None, date_time=None):
+        """Создает элемент из несжатых данных.
+
+        Без compress_type способ сжатия выбирается по расширению (compression_for);
+        несжатые данные хранятся без копирования.
+        """
+        if compress_type is None:
+            compress_type = compression_for(name)
+        if compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            payload = compressor.compress(data) + compressor.flush()
+        else:
+            payload = data
+        return cls(name, payload, zlib.crc32(data), len(data), compress_type,
+                   date_time or time.localtime()[:6])
+
+
+def read_members(data):
+    """Возвращает элементы существующего архива без их распаковки"""
+    view = memoryview(data)
+    members = []
+    with zipfile.ZipFile(BytesIO(data)) as archive:
+        for info in archive.infolist():
+            header = _LOCAL_HEADER.unpack_from(view, info.header_offset)
+            name_len, extra_len = header[9], header[10]
+            start = info.header_offset + _LOCAL_HEADER.size + name_len + extra_len
+            payload = bytes(view[start:start + info.compress_size])
+            members.append(ZipMember(info.filename, payload, info.CRC, info.file_size,
+                                     info.compress_type, info.date_time))
+    return members
+
+
+def iter_zip(members):
+    """Генератор байтов архива из готовых элементов"""
+    offset = 0
+    central = []
+    for member in members:
+        name = member.name.encode('utf-8')
+        flags = _UTF8_FLAG if not member.name.isascii() else 0
+        dos_time, dos_date = _dos_datetime(member.date_time)
+        header = _LOCAL_HEADER.pack(
+            0x04034b50, 20, flags, member.compress_type, dos_time, dos_date,
+            member.crc, len(member.payload), member.size, len(name), 0)
+        central.append(_CENTRAL_HEADER.pack(
+            0x02014b50, 20, 20, flags, member.compress_type, dos_time, dos_date,
+            member.crc, len(member.payload), member.size, len(name), 0, 0, 0, 0,
+            0, offset) + name)
+        yield header + name
+        yield member.payload
+        offset += len(header) + len(name) + len(member.payload)
+
+    directory = b''.join(central)
+    yield directory
+    yield _END_RECORD.pack(0x06054b50, 0, 0, len(central), len(central),
+                           len(directory), offset, 0)
+
+
+def zip_size(members):
+    """Размер архива, который соберет iter_zip, без его сборки"""
+    size = _END_RECORD.size
+    for member in members:
+        name_len = len(member.name.encode('utf-8'))
+        size += _LOCAL_HEADER.size + _CENTRAL_HEADER.size + 2 * name_len + len(member.payload)
+    return size
+
+
+def build_zip(members):
+    """Собирает архив целиком в байты"""
+    return b''.join(iter_zip(members))
+
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    dos_date = (max(year, 1980) - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_time, dos_date
+